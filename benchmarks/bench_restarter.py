@@ -0,0 +1,243 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+
+    Benchmarks for the restarter hot paths.
+
+    Usage: python benchmarks/bench_restarter.py [--save-baseline]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from resolve_restart import search_previous, INDEX_FILE
+from backup_store import BackupStore
+from main import DynamicRestart
+from autotune import cpu_signature
+from statistics import median
+from time import perf_counter
+import tracemalloc
+import argparse
+import tempfile
+import shutil
+import struct
+import json
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def write_binary(path, atoms, seed=0.0):
+    """Write a namd binary coor/vel file without holding it in memory"""
+
+    block = struct.pack('3d', 1.0 + seed, 2.0, 3.0) * 4096
+    with open(path, 'wb') as binary:
+        binary.write(struct.pack('i', atoms))
+        remaining = atoms * 24
+        while remaining > 0:
+            chunk = block[:remaining]
+            binary.write(chunk)
+            remaining -= len(chunk)
+
+
+def generate_run(folder, name='prod', atoms=10000, files=1000, conf_lines=1000, step=50000):
+    """Create a synthetic previous run folder"""
+
+    os.makedirs(folder, exist_ok=True)
+    write_binary(os.path.join(folder, name + '.restart.coor'), atoms)
+    write_binary(os.path.join(folder, name + '.restart.vel'), atoms, 0.5)
+    with open(os.path.join(folder, name + '.restart.xsc'), 'w') as xsc:
+        xsc.write('# NAMD extended system configuration restart file\n'
+                  '#$LABELS step a_x a_y a_z b_x b_y b_z c_x c_y c_z o_x o_y o_z\n'
+                  + str(step) + ' 100 0 0 0 100 0 0 0 100 0 0 0\n')
+
+    with open(os.path.join(folder, 'system.psf'), 'w') as psf:
+        psf.write('PSF\n\n       1 !NTITLE\n REMARKS synthetic\n\n' + format(atoms, '8d') + ' !NATOM\n')
+
+    with open(os.path.join(folder, name + '.conf'), 'w') as conf:
+        conf.write('structure ' + os.path.join(folder, 'system.psf') + '\n'
+                   'coordinates ' + os.path.join(folder, 'system.pdb') + '\n'
+                   'set outputname ' + os.path.join(folder, name) + '\n'
+                   'outputName $outputname\n'
+                   'temperature 310\nfirsttimestep 0\ntimestep 2.0\nrestartfreq 5000\n')
+        for line in range(conf_lines):
+            conf.write('# generated option ' + str(line) + '\nparam' + str(line) + ' ' + str(line) + '\n')
+        conf.write('run ' + str(step * 2) + '\n')
+
+    # Unrelated output spread over sub folders, as left by analysis tools
+    for i in range(files):
+        sub = os.path.join(folder, 'analysis', str(i % 50))
+        os.makedirs(sub, exist_ok=True)
+        suffix = '.restart.dat' if i % 10 == 0 else '.dat'
+        open(os.path.join(sub, 'file' + str(i) + suffix), 'w').close()
+
+    return folder
+
+
+def measure(function, repeat, setup=None):
+    """Run function repeat times, return median seconds and peak traced memory"""
+
+    times = list()
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+
+    # Tracing slows allocations down, so peak memory gets its own run
+    if setup:
+        setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'seconds': median(times), 'peak_kb': peak / 1024}
+
+
+def restart_kwargs(previous, restart):
+    """Arguments for a prepare only restart"""
+
+    return dict(conf=None, backup=False, namd=False, namd_exe='namd', options=[], previous=previous,
+                restart=restart, run=None, threads=1, file_name=None, pipeline=True)
+
+
+def run_benchmarks(args, work):
+    """Run all benchmarks on work folder"""
+
+    previous = generate_run(os.path.join(work, 'previous'), atoms=args.atoms, files=args.files,
+                            conf_lines=args.conf_lines)
+    output = os.path.join(work, 'restart')
+    os.makedirs(output, exist_ok=True)
+    results = dict()
+
+    def cold_search():
+        try:
+            os.remove(os.path.join(output, INDEX_FILE))
+        except FileNotFoundError:
+            pass
+        search_previous(previous, silent=True, cache_folder=output)
+
+    results['search_previous_cold'] = measure(cold_search, args.repeat)
+    results['search_previous_cached'] = measure(
+        lambda: search_previous(previous, silent=True, cache_folder=output), args.repeat)
+
+    phases = list()
+
+    def prepare():
+        dynamic = DynamicRestart(**restart_kwargs(previous, output))
+        dynamic.execute()
+        phases.append(dynamic.timer.phases)
+
+    results['restart_end_to_end'] = measure(prepare, args.repeat)
+    for phase in ('read_conf', 'configure_restart', 'save_conf'):
+        results[phase] = {'seconds': median(run[phase] for run in phases), 'peak_kb': None}
+
+    backup_files = generate_run(os.path.join(work, 'backup'), atoms=args.backup_atoms, files=0, conf_lines=0)
+    restart_files = {kind: os.path.join(backup_files, 'prod.restart.' + kind) for kind in ('xsc', 'coor', 'vel')}
+    counter = [0]
+
+    def new_restart():
+        counter[0] += 1
+        write_binary(restart_files['coor'], args.backup_atoms, counter[0])
+        write_binary(restart_files['vel'], args.backup_atoms, counter[0])
+
+    results['backup_changed'] = measure(
+        lambda: BackupStore(backup_files, 'prod', generations=2).backup(restart_files, counter[0]),
+        args.repeat, new_restart)
+    results['backup_unchanged'] = measure(
+        lambda: BackupStore(backup_files, 'prod', generations=2).backup(restart_files, counter[0] + 1), args.repeat)
+
+    return results
+
+
+def compare(results, baseline, threshold, min_delta):
+    """Return benchmarks slower than baseline by more than threshold"""
+
+    regressions = list()
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        slowdown = result['seconds'] - reference['seconds']
+        if slowdown > reference['seconds'] * threshold and slowdown > min_delta:
+            regressions.append((name, reference['seconds'], result['seconds']))
+    return regressions
+
+
+def main():
+    """Run benchmarks and check against baseline"""
+
+    parser = argparse.ArgumentParser(description='Benchmark namd restarter hot paths.')
+    parser.add_argument('--files', default=5000, type=int, help='Files on synthetic previous run')
+    parser.add_argument('--atoms', default=100000, type=int, help='Atoms on synthetic restart files')
+    parser.add_argument('--backup-atoms', default=2000000, type=int, help='Atoms on restart files to back up')
+    parser.add_argument('--conf-lines', default=5000, type=int, help='Options on synthetic conf file')
+    parser.add_argument('--repeat', default=9, type=int, help='Runs of each benchmark')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline json file')
+    parser.add_argument('--save-baseline', action='store_true', help='Store results as new baseline')
+    parser.add_argument('--threshold', default=0.5, type=float, help='Allowed slowdown over baseline')
+    parser.add_argument('--min-delta', default=0.01, type=float, help='Ignore slowdowns below # seconds')
+    parser.add_argument('--work-dir', default=None, help='Folder for synthetic data (default: temporary)')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='namd_restarter_bench_', dir=args.work_dir)
+    try:
+        results = run_benchmarks(args, work)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    for name, result in results.items():
+        peak = format(result['peak_kb'], '.0f') + ' KiB' if result['peak_kb'] is not None else '-'
+        print(format(name, '26s') + format(result['seconds'] * 1000, '10.2f') + ' ms  peak ' + peak)
+
+    # Timings only compare on the same kind of host, the baseline keeps one entry per cpu
+    host = cpu_signature()
+    baselines = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline:
+            baselines = json.load(baseline)
+
+    if args.save_baseline:
+        baselines[host] = results
+        with open(args.baseline, 'w') as baseline:
+            json.dump(baselines, baseline, indent=1)
+        print('Baseline for ' + host + ' saved at ' + args.baseline)
+        return 0
+
+    if not baselines:
+        print('No baseline found at ' + args.baseline + ', run with --save-baseline to create one.')
+        return 1
+
+    if host not in baselines:
+        print('No baseline for ' + host + ' on ' + args.baseline + ', skipping comparison. '
+              'Run with --save-baseline to add one.')
+        return 0
+
+    regressions = compare(results, baselines[host], args.threshold, args.min_delta)
+
+    for name, before, after in regressions:
+        print('REGRESSION ' + name + ': ' + format(before * 1000, '.2f') + ' ms -> ' + format(after * 1000, '.2f') + ' ms')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -42,10 +42,12 @@ def make_parser():
                                      formatter_class=SubcommandHelpFormatter)
     required = parser.add_argument_group('Required')
     optional = parser.add_argument_group('Optional')
+    batch = parser.add_argument_group('Batch')
+    daemon = parser.add_argument_group('Daemon')
 
-    required.add_argument('-i', '--input', metavar='', dest='previous', required=True,
+    required.add_argument('-i', '--input', metavar='', dest='previous',
                           help='Previous dynamic folder')
-    required.add_argument('-o', '--output', metavar='', dest='restart', required=True,
+    required.add_argument('-o', '--output', metavar='', dest='restart',
                           help='Restart output folder')
     optional.add_argument("-h", "--help", action="help",
                           help="Show this help message and exit")
@@ -63,7 +65,95 @@ def make_parser():
                           help='Disable automatically running namd after end')
     optional.add_argument('-B', '--backup', action='store_true',
                           help='Save backups for restart files while running namd')
+    optional.add_argument('--backup-generations', default=3, type=int, metavar='',
+                          help='Number of backup generations to keep (default: 3)')
+    optional.add_argument('--backup-compress', choices=['gzip', 'bz2', 'lzma'], metavar='',
+                          help='Compress backup generations with gzip, bz2 or lzma')
     optional.add_argument('-t', '--threads', default=1, type=int, metavar='',
                           help='Number of cores to run namd when automatically running (default: 1)')
+    optional.add_argument('-T', '--autotune', action='store_true',
+                          help='Benchmark short namd runs to choose cores and pinning, cached per system, host and -t')
+    optional.add_argument('--autotune-steps', default=500, type=int, metavar='',
+                          help='Steps of each autotune benchmark run (default: 500)')
+    optional.add_argument('--autotune-ppn', action='store_true',
+                          help='Also benchmark +ppn settings for smp namd builds')
+    optional.add_argument('-R', '--retries', default=0, type=int, metavar='',
+                          help='Relaunch namd from the newest restart files up to # times after a failure')
+    optional.add_argument('--retry-backoff', default=60, type=float, metavar='',
+                          help='Seconds to wait before the first relaunch, doubled each time (default: 60)')
+    optional.add_argument('-S', '--chain-segment', type=int, metavar='',
+                          help='Run remaining steps as chained segments of # steps, each on its own folder')
+    optional.add_argument('-W', '--watchdog', action='store_true',
+                          help='Stop namd when ENERGY output diverges and relaunch it with safer settings')
+    optional.add_argument('--watchdog-jump', default=0.1, type=float, metavar='',
+                          help='Largest relative TOTAL energy change between ENERGY lines (default: 0.1)')
+    optional.add_argument('--watchdog-temp', nargs=2, type=float, metavar='',
+                          help='Allowed TEMP band as <min> <max>')
+    optional.add_argument('--watchdog-pressure', nargs=2, type=float, metavar='',
+                          help='Allowed PRESSURE band as <min> <max>')
+    optional.add_argument('--watchdog-timestep', default=0.5, type=float, metavar='',
+                          help='Timestep factor applied on each relaunch after divergence (default: 0.5)')
+    optional.add_argument('--watchdog-options', metavar='', default=[], action='append', nargs='+',
+                          help='Additional options to include in .conf file on relaunches after divergence')
+    optional.add_argument('--watchdog-max', default=3, type=int, metavar='',
+                          help='Relaunch after divergence up to # times (default: 3)')
+    optional.add_argument('--trim-dcd', action='store_true',
+                          help='Cut previous dcd in place after the restart step frame')
+    optional.add_argument('--recover-dcd', action='store_true',
+                          help='When no restart set is usable, restart from the last complete dcd frame')
+    optional.add_argument('--energy-series', action='store_true',
+                          help='After namd, extract ENERGY fields of all run logs to <output>/<name>.energy')
+    optional.add_argument('--io-advisor', choices=['report', 'apply'], metavar='',
+                          help='Measure output storage and report or apply restartfreq and dcdfreq')
+    optional.add_argument('--io-mtbf', default=24, type=float, metavar='',
+                          help='Expected hours between failures for the I/O advisor (default: 24)')
+    optional.add_argument('--io-budget', default=0.02, type=float, metavar='',
+                          help='Largest wall time fraction for trajectory writes (default: 0.02)')
+    optional.add_argument('--log-capture', choices=['gzip', 'bz2', 'lzma'], metavar='',
+                          help='Compress full namd output with gzip, bz2 or lzma and keep a short summary .log')
+    optional.add_argument('--log-rotate', default=1024, type=float, metavar='',
+                          help='Start a new compressed log part every # MB of output (default: 1024)')
+    optional.add_argument('--scratch', metavar='',
+                          help='Stage inputs on this node local folder and run namd there, syncing output back')
+    optional.add_argument('--sync-interval', default=300, type=float, metavar='',
+                          help='Seconds between output syncs from scratch (default: 300)')
+    optional.add_argument('--stage', metavar='',
+                          help='Restart prefix to use when input holds many, or latest (newest step, default) '
+                               'or recent (newest files)')
+    optional.add_argument('--scheduler', default='local', choices=['local', 'slurm', 'pbs'], metavar='',
+                          help='Run namd locally or submit it as a slurm or pbs job (default: local)')
+    optional.add_argument('--walltime', metavar='',
+                          help='Walltime of submitted jobs (e.g., 24:00:00)')
+    optional.add_argument('--queue', metavar='',
+                          help='Partition or queue of submitted jobs')
+    optional.add_argument('--scheduler-options', metavar='', default=[], action='append',
+                          help='Extra scheduler directive for submitted jobs (e.g., --account=abc)')
+    optional.add_argument('-M', '--metrics', action='store_true',
+                          help='Export namd progress to a json status file and a prometheus textfile')
+    optional.add_argument('--metrics-dir', metavar='',
+                          help='Folder for the prometheus textfile (default: output folder)')
+    optional.add_argument('--metrics-interval', default=30, type=float, metavar='',
+                          help='Seconds between metrics updates (default: 30)')
+    optional.add_argument('-P', '--pipeline', action='store_true',
+                          help='Non-interactive mode, skip pauses between steps')
+    optional.add_argument('--timing', metavar='',
+                          help='Append per phase timings as json lines to this file')
+    optional.add_argument('-v', '--verbose', action='store_true',
+                          help='Print debug messages such as phase timings and backup copy methods')
+    batch.add_argument('-b', '--batch', action='store_true',
+                       help='Restart many dynamics: -i is a glob of previous folders or a manifest file, '
+                            '-o is the root output folder and -t the total cores budget')
+    batch.add_argument('-j', '--jobs', default=None, type=int, metavar='',
+                       help='Number of parallel processes preparing .conf files (default: cpu count)')
+    batch.add_argument('--job-threads', default=None, type=int, metavar='',
+                       help='Cores given to each namd run in batch mode (default: split budget evenly)')
+    batch.add_argument('--array-limit', type=int, metavar='',
+                       help='Maximum array tasks running at once when submitting to a scheduler')
+    batch.add_argument('--pin', action='store_true',
+                       help='Pin each namd run to its own cores with +setcpuaffinity/+pemap')
+    batch.add_argument('--all-stages', action='store_true',
+                       help='Restart every restart prefix found on input (e.g., replicas), each named after it')
+    daemon.add_argument('--daemon', metavar='',
+                        help='Serve json restart requests on this unix socket, other options are request defaults')
 
     return parser
@@ -0,0 +1,290 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from prepare_dynamic import finish_dynamic, namd_command
+from restart_watcher import RestartSet, init_inotify, add_watch, remove_watch, read_watch_events
+from backup_store import BackupStore
+from log_monitor import LogMonitor
+from log_capture import LogCapture, CHUNK
+from conf_model import NamdConf
+from color_log import log
+from time import time
+import asyncio
+import signal
+import os
+
+
+SETTLE = 2
+POLL = 60
+
+
+def format_pemap(cores):
+    """Format a list of core ids as a charm++ pemap"""
+
+    ranges = list()
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+
+    return ','.join(str(a) if a == b else str(a) + '-' + str(b) for a, b in ranges)
+
+
+class AsyncJob:
+    """A namd run supervised from the event loop"""
+
+    def __init__(self, system, output, args):
+        self.system = system
+        self.output = output
+        self.restart_set = RestartSet(output)
+        self.process = None
+        self.wd = None
+        self.settling = None
+        self.lock = asyncio.Lock()
+
+        self.store = None
+        if args.backup:
+            self.store = BackupStore(os.path.dirname(output), os.path.basename(output),
+                                     args.backup_generations, args.backup_compress)
+
+        self.capture = None
+        if args.log_capture:
+            self.capture = LogCapture(output + '.log', output + '.err', args.log_capture, args.log_rotate)
+
+        self.monitor = None
+        if args.metrics:
+            log_file = None if self.capture else output + '.log'
+            self.monitor = LogMonitor.from_conf(NamdConf.read(output + '.conf'), log_file, output,
+                                                args.metrics_dir, args.metrics_interval)
+            if self.capture:
+                self.capture.listeners.append(self.monitor.parser.feed)
+
+
+class AsyncRunner:
+    """Run many namd jobs from one event loop under a cores budget"""
+
+    def __init__(self, prepared, args):
+        self.prepared = prepared
+        self.args = args
+        self.budget = max(args.threads, 1)
+        self.job_cores = min(args.job_threads or max(1, self.budget // len(prepared)), self.budget)
+        self.free_cores = list(range(self.budget))
+        self.cores_ready = None
+        self.running = list()
+        self.watches = dict()
+        self.results = dict()
+        self.inotify = None
+        self.terminating = False
+
+    async def run(self):
+        """Run all jobs, return {system: state}"""
+
+        loop = asyncio.get_running_loop()
+        self.cores_ready = asyncio.Condition()
+
+        # One inotify descriptor watches every output folder
+        self.inotify = init_inotify()
+        if self.inotify is not None:
+            loop.add_reader(self.inotify, self.on_events)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.terminate)
+
+        log('info', 'Running ' + str(len(self.prepared)) + ' namd jobs with ' + str(self.job_cores) + ' cores each.')
+        ticker = asyncio.create_task(self.tick())
+        try:
+            await asyncio.gather(*(self.run_job(system, output) for system, output in self.prepared))
+        finally:
+            ticker.cancel()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+            if self.inotify is not None:
+                loop.remove_reader(self.inotify)
+                os.close(self.inotify)
+
+        return self.results
+
+    async def run_job(self, system, output):
+        """Wait for free cores, then run one job"""
+
+        async with self.cores_ready:
+            await self.cores_ready.wait_for(lambda: self.terminating or len(self.free_cores) >= self.job_cores)
+            if self.terminating:
+                self.results[system] = 'terminated'
+                return
+            cores, self.free_cores = self.free_cores[:self.job_cores], self.free_cores[self.job_cores:]
+
+        try:
+            self.results[system] = await self.supervise(AsyncJob(system, output, self.args), cores)
+        finally:
+            async with self.cores_ready:
+                self.free_cores = sorted(self.free_cores + cores)
+                self.cores_ready.notify_all()
+
+    async def supervise(self, job, cores):
+        """Run namd for a job until it exits, return its state"""
+
+        pemap = format_pemap(cores) if self.args.pin else None
+        cmd = namd_command(self.args.namd_exe, job.output + '.conf', self.job_cores, pemap)
+
+        try:
+            if job.capture:
+                job.process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                                   stderr=asyncio.subprocess.PIPE)
+                job.capture.open()
+            else:
+                with open(job.output + '.log', 'w') as out, open(job.output + '.err', 'w') as err:
+                    job.process = await asyncio.create_subprocess_exec(*cmd, stdout=out, stderr=err)
+        except (PermissionError, FileNotFoundError):
+            log('error', 'Namd exe not found! Please specify path with -e.')
+            return 'failed'
+
+        log('info', 'Started ' + job.system + ' on cores ' + format_pemap(cores) + '.')
+        self.watch(job)
+
+        # Output pipes are read on the event loop until namd closes them
+        err_message = None
+        if job.capture:
+            await asyncio.gather(self.pump(job.process.stdout, job.capture.write_output),
+                                 self.pump(job.process.stderr, job.capture.write_errors))
+            err_message = job.capture.close()
+        returncode = await job.process.wait()
+
+        self.unwatch(job)
+        await self.backup(job)
+        if job.monitor:
+            job.monitor.update()
+
+        log('info', 'Finished ' + job.system + '.')
+        if finish_dynamic(job.output + '.err', err_message, returncode, 'terminated' if self.terminating else None):
+            return 'restarted'
+        return 'terminated' if self.terminating else 'failed'
+
+    async def pump(self, stream, write):
+        """Pass chunks of a process stream to write until it ends"""
+
+        while True:
+            data = await stream.read(CHUNK)
+            if not data:
+                return
+            write(data)
+
+    def watch(self, job):
+        """Follow a running job restart writes"""
+
+        self.running.append(job)
+        if self.inotify is None:
+            return
+        wd = add_watch(self.inotify, os.path.dirname(os.path.abspath(job.output)))
+        if wd >= 0:
+            job.wd = wd
+            self.watches.setdefault(wd, list()).append(job)
+
+    def unwatch(self, job):
+        """Stop following a job"""
+
+        self.running.remove(job)
+        if job.settling:
+            job.settling.cancel()
+        if job.wd is None:
+            return
+        jobs = self.watches[job.wd]
+        jobs.remove(job)
+        if not jobs:
+            del self.watches[job.wd]
+            remove_watch(self.inotify, job.wd)
+
+    def on_events(self):
+        """Dispatch inotify events to the jobs of each folder"""
+
+        for wd, name in read_watch_events(self.inotify):
+            for job in self.watches.get(wd, ()):
+                if name in job.restart_set.names:
+                    self.settle(job)
+
+    def settle(self, job):
+        """Back up a job restart set once its writes stop"""
+
+        if job.store is None:
+            return
+        if job.settling:
+            job.settling.cancel()
+        loop = asyncio.get_running_loop()
+        job.settling = loop.call_later(SETTLE, lambda: asyncio.ensure_future(self.backup(job)))
+
+    async def backup(self, job):
+        """Back up a new complete restart set off the event loop"""
+
+        if job.store is None:
+            return
+        async with job.lock:
+            step = job.restart_set.ready()
+            if step is None:
+                return
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, job.store.backup, job.restart_set.files, step)
+            except OSError as error:
+                log('warning', 'Could not backup restart files of ' + job.system + ': ' + str(error))
+                return
+            job.restart_set.mark(step)
+
+    async def tick(self):
+        """Update metrics and poll restart files inotify may miss"""
+
+        poll = POLL if self.inotify is not None else 5
+        interval = min(poll, self.args.metrics_interval) if self.args.metrics else poll
+        last_poll = time()
+
+        while True:
+            await asyncio.sleep(interval)
+            polling = time() - last_poll >= poll
+            if polling:
+                last_poll = time()
+
+            for job in self.running:
+                if job.monitor:
+                    job.monitor.update()
+                if polling and job.store and job.restart_set.changed():
+                    self.settle(job)
+
+    def terminate(self):
+        """Forward termination to running namd and skip pending jobs"""
+
+        if self.terminating:
+            return
+        self.terminating = True
+        log('warning', 'Terminating ' + str(len(self.running)) + ' namd runs.')
+
+        for job in self.running:
+            if job.process.returncode is None:
+                job.process.send_signal(signal.SIGTERM)
+        asyncio.ensure_future(self.wake_pending())
+
+    async def wake_pending(self):
+        """Let jobs waiting for cores see termination"""
+
+        async with self.cores_ready:
+            self.cores_ready.notify_all()
+
+
+def run_systems(prepared, args):
+    """Run namd for prepared systems, return {system: state}"""
+
+    return asyncio.run(AsyncRunner(prepared, args).run())
@@ -0,0 +1,166 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from conf_model import NamdConf
+from log_monitor import NamdLogParser
+from color_log import log
+import subprocess
+import platform
+import shutil
+import json
+import os
+
+
+OUTPUT_OPTIONS = ['dcdfreq', 'veldcdfreq', 'forcedcdfreq', 'restartfreq', 'xstfreq', 'imdon']
+
+
+def cache_file():
+    """Path of the autotune cache"""
+
+    folder = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(folder, 'namd-restarter', 'autotune.json')
+
+
+def cpu_signature():
+    """Describe host cpu model and core count"""
+
+    model = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith('model name'):
+                    model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return model + ' x' + str(os.cpu_count())
+
+
+def cache_key(atoms, max_cores, ppn=False):
+    """Key systems of similar size on the same kind of host, core budget and launch mode"""
+
+    # Round atom count to two significant digits so similar systems share a result
+    bucket = int(float(format(atoms, '.2g')))
+    return cpu_signature() + '|' + str(bucket) + '|' + str(max_cores) + '|' + ('ppn' if ppn else 'p')
+
+
+def load_cache():
+    """Load cached launch settings"""
+
+    try:
+        with open(cache_file()) as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_cache(key, entry):
+    """Store best launch settings for key"""
+
+    cache = load_cache()
+    cache[key] = entry
+    os.makedirs(os.path.dirname(cache_file()), exist_ok=True)
+    with open(cache_file() + '.tmp', 'w') as file:
+        json.dump(cache, file, indent=1)
+    os.replace(cache_file() + '.tmp', cache_file())
+
+
+def candidates(max_cores, ppn=False):
+    """Launch settings to benchmark"""
+
+    counts = sorted({max_cores, *(2 ** i for i in range(max_cores.bit_length()) if 2 ** i <= max_cores)})
+    settings = list()
+    for cores in counts:
+        settings.append(['+p' + str(cores)])
+        settings.append(['+p' + str(cores), '+setcpuaffinity'])
+        if ppn and cores > 1:
+            settings.append(['+p' + str(cores), '+ppn', str(cores), '+setcpuaffinity'])
+    return settings
+
+
+def bench_conf(conf, folder, steps):
+    """Write a short run conf without trajectory and restart output"""
+
+    bench = NamdConf.read(conf)
+    bench.set('set outputname ' + os.path.join(folder, 'bench'))
+    bench.set('outputname ' + os.path.join(folder, 'bench'))
+    for option in OUTPUT_OPTIONS:
+        line = bench.find(option)
+        if line is not None and not line.commented:
+            bench.comment(option)
+    bench.set('outputenergies ' + str(steps))
+    bench.set('outputtiming ' + str(max(steps // 5, 1)))
+    bench.set('run ' + str(steps))
+
+    path = os.path.join(folder, 'bench.conf')
+    bench.save(path)
+    return path, bench.value('timestep', 1)
+
+
+def benchmark(namd_exe, conf, args, timestep, timeout):
+    """Run namd with args and return ns/day from the last TIMING line"""
+
+    parser = NamdLogParser(timestep)
+    try:
+        output = subprocess.run([namd_exe, *args, conf], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                timeout=timeout, check=False)
+    except subprocess.TimeoutExpired:
+        return None
+    except (PermissionError, FileNotFoundError):
+        log('error', 'Namd exe not found! Please specify path with -e.')
+        return None
+
+    for line in output.stdout.decode(errors='replace').splitlines():
+        parser.feed(line)
+    return parser.metrics()['ns_per_day']
+
+
+def autotune(namd_exe, conf, atoms, max_cores, steps=500, ppn=False, timeout=600, refresh=False):
+    """Get best namd launch arguments for conf, benchmarking when not cached"""
+
+    key = cache_key(atoms, max_cores, ppn)
+    cached = load_cache().get(key)
+    if cached and not refresh:
+        log('info', 'Using cached launch settings "' + ' '.join(cached['args']) + '" (' +
+            format(cached['ns_per_day'], '.2f') + ' ns/day).')
+        return cached['args']
+
+    folder = os.path.join(os.path.dirname(conf), 'autotune')
+    os.makedirs(folder, exist_ok=True)
+    bench, timestep = bench_conf(conf, folder, steps)
+
+    results = dict()
+    for args in candidates(max_cores, ppn):
+        log('info', 'Benchmarking namd with "' + ' '.join(args) + '".')
+        ns_per_day = benchmark(namd_exe, bench, args, timestep, timeout)
+        if ns_per_day:
+            results[' '.join(args)] = ns_per_day
+            log('info', 'Got ' + format(ns_per_day, '.2f') + ' ns/day.')
+
+    shutil.rmtree(folder, ignore_errors=True)
+
+    if not results:
+        log('warning', 'Autotune got no timing results. Using default launch settings.')
+        return None
+
+    best = max(results, key=results.get)
+    save_cache(key, {'args': best.split(), 'ns_per_day': results[best], 'atoms': atoms, 'tested': results})
+    log('info', 'Best launch settings "' + best + '" (' + format(results[best], '.2f') + ' ns/day).')
+    return best.split()
@@ -0,0 +1,249 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from color_log import log
+import hashlib
+import shutil
+import json
+import os
+
+
+BACKUP_FOLDER = 'backups'
+FICLONE = 0x40049409
+CHUNK = 16 * 1024 * 1024
+COMPRESSORS = {
+    'gzip': ('gzip', '.gz'),
+    'bz2': ('bz2', '.bz2'),
+    'lzma': ('lzma', '.xz'),
+}
+
+
+def remove_file(path):
+    """Remove path if it exists"""
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def fast_copy(source, target):
+    """Copy file with the cheapest method available and return its name"""
+
+    # Never write through an existing target, it may be a hard link to a stored generation
+    remove_file(target)
+    with open(source, 'rb') as src, open(target, 'xb') as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        size = os.fstat(src_fd).st_size
+
+        try:
+            import fcntl
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return 'reflink'
+        except (ImportError, OSError):
+            pass
+
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size:
+                    sent = os.copy_file_range(src_fd, dst_fd, size - copied, copied, copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                if copied >= size:
+                    return 'copy_file_range'
+            except OSError:
+                pass
+
+        if hasattr(os, 'sendfile'):
+            try:
+                while copied < size:
+                    os.lseek(dst_fd, copied, os.SEEK_SET)
+                    sent = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                if copied >= size:
+                    return 'sendfile'
+            except OSError:
+                pass
+
+        src.seek(copied)
+        dst.seek(copied)
+        shutil.copyfileobj(src, dst, CHUNK)
+        return 'buffered'
+
+
+def compress_copy(source, target, compress):
+    """Copy file compressing with a stdlib compressor"""
+
+    module = __import__(COMPRESSORS[compress][0])
+    remove_file(target)
+    with open(source, 'rb') as src, module.open(target, 'xb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK)
+    return compress
+
+
+def file_hash(path):
+    """Hash file content"""
+
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def replace_file(tmp, target):
+    """Move tmp over target, dropping tmp when both already link the same file"""
+
+    # Renaming a hard link over itself is a no-op that would leave tmp behind
+    if os.path.exists(target) and os.path.samefile(tmp, target):
+        os.remove(tmp)
+    else:
+        os.replace(tmp, target)
+
+
+def link_or_copy(source, target):
+    """Hard link source on target falling back to a copy"""
+
+    remove_file(target)
+    try:
+        os.link(source, target)
+        return 'link'
+    except OSError:
+        return fast_copy(source, target)
+
+
+class BackupStore:
+    """Rotated, deduplicated generations of restart sets"""
+
+    def __init__(self, folder, file_name, generations=3, compress=None):
+        self.folder = os.path.join(folder, BACKUP_FOLDER)
+        self.file_name = file_name
+        self.generations = max(generations, 1)
+        self.compress = compress
+        self.manifest_file = os.path.join(self.folder, file_name + '.manifest.json')
+        self.manifest = self.load()
+
+    def load(self):
+        """Load manifest of stored generations"""
+
+        try:
+            with open(self.manifest_file) as manifest:
+                return json.load(manifest)
+        except (OSError, ValueError):
+            return {'generations': [], 'sources': {}}
+
+    def save(self):
+        """Save manifest atomically"""
+
+        with open(self.manifest_file + '.tmp', 'w') as manifest:
+            json.dump(self.manifest, manifest, indent=1)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+    def source_hash(self, path):
+        """Hash source reusing the hash of an unchanged file"""
+
+        stat = os.stat(path)
+        cached = self.manifest['sources'].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = file_hash(path)
+        self.manifest['sources'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def stored(self, digest):
+        """Find a stored file with the same content and compression"""
+
+        for generation in reversed(self.manifest['generations']):
+            for entry in generation['files'].values():
+                if entry['hash'] == digest and entry['compress'] == self.compress:
+                    path = os.path.join(self.folder, entry['file'])
+                    if os.path.exists(path):
+                        return path
+        return None
+
+    def backup(self, restart_files, step):
+        """Store restart set as generation of step"""
+
+        os.makedirs(self.folder, exist_ok=True)
+        hashes = {kind: self.source_hash(file) for kind, file in restart_files.items()}
+
+        generations = self.manifest['generations']
+        if generations and {kind: entry['hash'] for kind, entry in generations[-1]['files'].items()} == hashes:
+            log('debug', 'Restart files unchanged since step ' + str(generations[-1]['step']) + '.')
+            return None
+
+        suffix = COMPRESSORS[self.compress][1] if self.compress else ''
+        generation = {'step': int(step), 'files': dict()}
+        for kind, source in restart_files.items():
+            name = os.path.basename(source) + '.' + str(step) + suffix
+            target = os.path.join(self.folder, name)
+            tmp = target + '.tmp'
+
+            previous = self.stored(hashes[kind])
+            if previous:
+                method = link_or_copy(previous, tmp)
+            elif self.compress:
+                method = compress_copy(source, tmp, self.compress)
+            else:
+                method = fast_copy(source, tmp)
+            replace_file(tmp, target)
+
+            log('debug', 'Backup ' + name + ' written with ' + method + '.')
+            generation['files'][kind] = {'file': name, 'hash': hashes[kind], 'compress': self.compress,
+                                         'source': os.path.basename(source)}
+
+        generations.append(generation)
+        self.rotate()
+        self.write_slot(restart_files, generation)
+        self.save()
+
+        log('info', 'Restart files backed up at step ' + str(step) + '.')
+        return generation
+
+    def write_slot(self, restart_files, generation):
+        """Keep the plain .bak copies next to restart files up to date"""
+
+        for kind, source in restart_files.items():
+            entry = generation['files'][kind]
+            slot = source + '.bak'
+            tmp = slot + '.tmp'
+
+            if self.compress:
+                fast_copy(source, tmp)
+            else:
+                link_or_copy(os.path.join(self.folder, entry['file']), tmp)
+            replace_file(tmp, slot)
+
+    def rotate(self):
+        """Remove generations beyond the configured number"""
+
+        generations = self.manifest['generations']
+        while len(generations) > self.generations:
+            old = generations.pop(0)
+            for entry in old['files'].values():
+                try:
+                    os.remove(os.path.join(self.folder, entry['file']))
+                except FileNotFoundError:
+                    pass
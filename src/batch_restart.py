@@ -0,0 +1,183 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from async_runner import run_systems
+from scheduler import get_backend, make_job
+from resolve_restart import index_restart, restart_stages
+from color_log import log
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import os
+
+
+def glob_root(pattern):
+    """Get the leading folders of a glob without wildcards"""
+
+    parts = os.path.normpath(pattern).split(os.sep)
+    root = list()
+    for part in parts:
+        if glob.has_magic(part):
+            return os.sep.join(root) or os.curdir
+        root.append(part)
+    return os.path.dirname(os.sep.join(root)) or os.curdir
+
+
+def read_systems(pattern, output):
+    """Get (previous, restart) folder pairs from a manifest file or a glob"""
+
+    systems = list()
+
+    if os.path.isfile(pattern):
+        with open(pattern) as manifest:
+            for line in manifest:
+                line = line.split('#')[0].split()
+                if not line:
+                    continue
+                previous = line[0]
+                restart = line[1] if len(line) > 1 else os.path.join(output, os.path.basename(previous.rstrip('/')))
+                systems.append((previous, restart))
+    else:
+        # Outputs keep the path below the glob root, so runs/*/prod gives <output>/a/prod
+        root = glob_root(pattern)
+        for previous in sorted(glob.glob(pattern)):
+            if os.path.isdir(previous):
+                systems.append((previous, os.path.join(output, os.path.relpath(previous, root))))
+
+    return systems
+
+
+def expand_stages(systems):
+    """Split each system in one system per restart prefix found on it"""
+
+    expanded = list()
+    for previous, restart, _ in systems:
+        stages = restart_stages(index_restart(previous, restart), os.path.abspath(previous))
+        if not stages:
+            expanded.append((previous, restart, None))
+        for stage in stages:
+            expanded.append((previous, restart, stage['name']))
+
+    return expanded
+
+
+def prepare_system(kwargs):
+    """Prepare one restart .conf file without running namd"""
+
+    from main import DynamicRestart
+
+    try:
+        dynamic = DynamicRestart(**kwargs)
+        dynamic.execute()
+    except Exception as error:
+        log('error', 'Failed preparing ' + kwargs['previous'] + ': ' + str(error))
+        return 'failed', None
+
+    if not dynamic.success:
+        return 'skipped', None
+
+    return 'prepared', dynamic.restart + dynamic.file_name
+
+
+def submit_systems(prepared, args):
+    """Submit all prepared systems as one scheduler array"""
+
+    job_cores = args.job_threads or args.threads
+    jobs = [make_job(args.namd_exe, output, job_cores) for _, output in prepared]
+
+    os.makedirs(args.restart, exist_ok=True)
+    backend = get_backend(args.scheduler, args.restart, args.walltime, args.queue,
+                          args.scheduler_options, args.array_limit)
+    ids = backend.submit(jobs)
+
+    return {system: 'submitted' if output + '.conf' in ids else 'failed' for system, output in prepared}
+
+
+def unsupported_options(args):
+    """Get flags set on args that batch runs would ignore"""
+
+    options = (('-R/--retries', args.retries), ('-W/--watchdog', args.watchdog), ('--scratch', args.scratch),
+               ('-T/--autotune', args.autotune), ('--energy-series', args.energy_series))
+    return [flag for flag, value in options if value]
+
+
+def run_batch(args):
+    """Prepare and run many restarts at once"""
+
+    unsupported = unsupported_options(args)
+    if unsupported:
+        log('critical', 'Options not supported in batch mode: ' + ', '.join(unsupported) + '. Aborting!')
+        return False
+
+    if args.batch:
+        systems = [(previous, restart, None) for previous, restart in read_systems(args.previous, args.restart)]
+    else:
+        systems = [(args.previous, args.restart, None)]
+    if args.all_stages:
+        systems = expand_stages(systems)
+    if not systems:
+        log('critical', 'No previous dynamic folders found for ' + args.previous + '. Aborting!')
+        return False
+
+    outputs = dict()
+    for previous, restart, stage in systems:
+        output = os.path.join(os.path.abspath(restart), stage or '')
+        if output in outputs:
+            log('critical', 'Systems ' + outputs[output] + ' and ' + previous + ' would write to ' + restart +
+                '. Aborting!')
+            return False
+        outputs[output] = previous
+
+    log('info', 'Preparing ' + str(len(systems)) + ' restarts.')
+
+    jobs = list()
+    for previous, restart, stage in systems:
+        kwargs = dict(vars(args))
+        kwargs.update(previous=previous, restart=restart, namd=False, batch=False)
+        if stage:
+            kwargs.update(stage=stage, file_name=stage.replace(os.sep, '_'))
+        jobs.append(kwargs)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        states = list(pool.map(prepare_system, jobs))
+
+    results = dict()
+    prepared = list()
+    for (previous, _, stage), (state, output) in zip(systems, states):
+        system = os.path.join(previous, stage) if stage else previous
+        results[system] = state
+        if state == 'prepared':
+            prepared.append((system, output))
+
+    if args.namd and prepared and args.scheduler != 'local':
+        results.update(submit_systems(prepared, args))
+    elif args.namd and prepared:
+        results.update(run_systems(prepared, args))
+
+    summary = {'prepared': [], 'submitted': [], 'restarted': [], 'skipped': [], 'terminated': [], 'failed': []}
+    for previous, state in results.items():
+        summary[state].append(previous)
+
+    log('info', 'Batch summary:')
+    for state, names in summary.items():
+        if names:
+            log('info' if state in ('prepared', 'submitted', 'restarted') else 'warning',
+                state.capitalize() + ' (' + str(len(names)) + '): ' + ', '.join(names))
+
+    return not summary['failed'] and not summary['terminated']
@@ -0,0 +1,150 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from restart_watcher import read_xsc_step
+from color_log import log
+import threading
+import json
+import copy
+import os
+
+
+def split_steps(first_step, steps, size):
+    """Split steps from first step in (first, steps) segments of size"""
+
+    segments = list()
+    start = first_step
+    while start < first_step + steps:
+        length = min(size, first_step + steps - start)
+        segments.append((start, length))
+        start += length
+    return segments
+
+
+class RestartChain:
+    """Run remaining steps as numbered segments, preparing the next while one runs"""
+
+    def __init__(self, dynamic, restart_step, restart_files, size):
+        self.dynamic = dynamic
+        self.restart_files = restart_files
+        self.manifest_file = dynamic.restart + 'chain.json'
+
+        steps = int(dynamic.run_steps)
+        self.segments = list()
+        for index, (first, length) in enumerate(split_steps(int(restart_step), steps, size), 1):
+            folder = dynamic.restart + 'seg' + format(index, '03d') + '/'
+            self.segments.append({'index': index, 'folder': folder, 'first_step': first,
+                                  'last_step': first + length, 'status': 'pending'})
+        self.prepared = dict()
+
+    def save_manifest(self):
+        """Record segments step ranges and status"""
+
+        manifest = {'name': self.dynamic.file_name, 'conf': self.dynamic.conf,
+                    'restart_files': self.restart_files, 'segments': self.segments}
+        with open(self.manifest_file + '.tmp', 'w') as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+    def segment_input(self, index):
+        """Restart files of segment index, the final output of the previous one"""
+
+        if index == 0:
+            return self.restart_files
+        output = self.segments[index - 1]['folder'] + self.dynamic.file_name
+        return {'coor': output + '.coor', 'vel': output + '.vel', 'xsc': output + '.xsc'}
+
+    def prepare(self, index):
+        """Write conf of segment index on its own folder"""
+
+        segment = self.segments[index]
+        dynamic = copy.copy(self.dynamic)
+        dynamic.restart = segment['folder']
+        dynamic.target_step = segment['last_step']
+
+        os.makedirs(dynamic.restart, exist_ok=True)
+        dynamic.conf_file = dynamic.read_conf()
+        if not dynamic.conf_file or not dynamic.configure_restart(str(segment['first_step']),
+                                                                 self.segment_input(index)):
+            segment['status'] = 'failed'
+            return None
+        dynamic.configure_optional()
+        dynamic.save_conf()
+
+        segment['status'] = 'prepared'
+        self.prepared[index] = dynamic
+        return dynamic
+
+    def finished(self, index):
+        """Check segment wrote its final output at the expected step"""
+
+        output = self.segment_input(index + 1)
+        if not all(os.path.exists(file) for file in output.values()):
+            return False
+        return read_xsc_step(output['xsc']) == self.segments[index]['last_step']
+
+    def run(self):
+        """Prepare and run all segments"""
+
+        log('info', 'Splitting restart in ' + str(len(self.segments)) + ' segments.')
+
+        if not self.dynamic.namd:
+            for index in range(len(self.segments)):
+                if not self.prepare(index):
+                    break
+            self.save_manifest()
+            log('info', 'Done.')
+            return all(segment['status'] == 'prepared' for segment in self.segments)
+
+        if not self.prepare(0):
+            self.save_manifest()
+            return False
+
+        for index, segment in enumerate(self.segments):
+            log('info', 'Running segment ' + str(index + 1) + ' from step ' + str(segment['first_step']) +
+                ' to ' + str(segment['last_step']) + '.')
+            segment['status'] = 'running'
+            self.save_manifest()
+
+            # Stage the next segment while this one runs
+            staging = None
+            if index + 1 < len(self.segments):
+                staging = threading.Thread(target=self.prepare, args=(index + 1,))
+                staging.start()
+
+            ok = self.prepared.pop(index).supervise_namd(str(segment['first_step']), self.segment_input(index))
+            if staging:
+                staging.join()
+
+            if not ok or not self.finished(index):
+                segment['status'] = 'failed'
+                self.save_manifest()
+                log('error', 'Segment ' + str(index + 1) + ' did not reach step ' + str(segment['last_step']) +
+                    '. Stopping chain.')
+                return False
+
+            segment['status'] = 'done'
+            if index + 1 < len(self.segments) and self.segments[index + 1]['status'] != 'prepared':
+                self.save_manifest()
+                return False
+
+        self.save_manifest()
+        log('info', 'Chain finished.')
+        return True
@@ -48,15 +48,23 @@ class CustomFormatter(logging.Formatter):
         return formatter.format(record)
 
 
-# create logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-ch.setFormatter(CustomFormatter())
-logger.addHandler(ch)
+# Library logger, silent until an entry point sets up the console
+logger = logging.getLogger('namd_restarter')
+logger.addHandler(logging.NullHandler())
+
+
+def setup_logging(level=logging.INFO):
+    """Print colored messages on the console"""
+
+    logger.setLevel(level)
+    if any(isinstance(handler.formatter, CustomFormatter) for handler in logger.handlers):
+        return
+
+    # create console handler with a higher log level
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    ch.setFormatter(CustomFormatter())
+    logger.addHandler(ch)
 
 
 def log(log_type, message):
@@ -0,0 +1,312 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+import re
+import os
+
+
+TOKENS = re.compile(r'[\s=]+')
+VARIABLE = re.compile(r'\$\{(\w+)\}|\$(\w+)')
+
+
+def parse_key(text):
+    """Get (keyword, commented) of a conf line"""
+
+    stripped = text.lstrip()
+    commented = stripped.startswith('#')
+    body = stripped[1:] if commented else stripped
+
+    # Only "#keyword value" counts as a commented option, "# text" is prose
+    if not body or body[0].isspace() or body[0] == '#':
+        return None, commented
+
+    tokens = TOKENS.split(body.strip(), maxsplit=2)
+    key = tokens[0].lower()
+    if key == 'set' and len(tokens) > 1:
+        # Tcl variable names are case sensitive
+        key = 'set ' + tokens[1]
+    return key, commented
+
+
+def line_ending(text):
+    """Get line ending of text"""
+
+    if text.endswith('\r\n'):
+        return '\r\n'
+    if text.endswith('\n'):
+        return '\n'
+    return ''
+
+
+class ConfLine:
+    """A conf line and the lines inserted after it"""
+
+    __slots__ = ('text', 'key', 'commented', 'inserted')
+
+    def __init__(self, text):
+        self.text = text
+        self.key, self.commented = parse_key(text)
+        self.inserted = list()
+
+    def copy(self):
+        """Copy of the line without inserted lines"""
+
+        line = ConfLine.__new__(ConfLine)
+        line.text, line.key, line.commented = self.text, self.key, self.commented
+        line.inserted = list()
+        return line
+
+    def values(self):
+        """Tokens after the keyword"""
+
+        body = self.text.lstrip().lstrip('#').strip()
+        tokens = TOKENS.split(body, maxsplit=2 if self.key and self.key.startswith('set ') else 1)
+        return tokens[2 if self.key and self.key.startswith('set ') else 1:]
+
+
+class NamdConf:
+    """Namd conf file indexed by case insensitive keyword"""
+
+    def __init__(self, path, lines):
+        self.path = os.path.abspath(path)
+        self.lines = [ConfLine(line) for line in lines]
+        self.newline = next((line_ending(line) for line in lines if line_ending(line)), '\n')
+        self.index = dict()
+        self.variables = dict()
+        self.includes = list()
+        self.modified = False
+
+        for line in self.lines:
+            self.add_index(line)
+
+        for line in self.index.get('source', []):
+            if not line.commented:
+                self.load_include(line)
+
+    @classmethod
+    def read(cls, path):
+        """Parse conf file keeping original line endings"""
+
+        with open(path, newline='') as conf:
+            return cls(path, conf.readlines())
+
+    def copy(self):
+        """Editable copy of an unedited conf without parsing it again"""
+
+        conf = NamdConf.__new__(NamdConf)
+        conf.path = self.path
+        conf.lines = [line.copy() for line in self.lines]
+        conf.newline = self.newline
+        conf.index = dict()
+        conf.variables = dict()
+        conf.includes = list()
+        conf.modified = False
+
+        for line in conf.lines:
+            conf.add_index(line)
+
+        sources = {id(line): copy for line, copy in zip(self.lines, conf.lines)}
+        for source, include in self.includes:
+            include = include.copy()
+            conf.includes.append((sources[id(source)], include))
+            for name, value in include.variables.items():
+                conf.variables.setdefault(name, value)
+        return conf
+
+    def files(self):
+        """Paths of conf and its sourced files"""
+
+        paths = [self.path]
+        for _, include in self.includes:
+            paths.extend(include.files())
+        return paths
+
+    def tree(self):
+        """Iterate over lines of this file and the lines inserted after them in file order"""
+
+        stack = list(reversed(self.lines))
+        while stack:
+            line = stack.pop()
+            yield line
+            stack.extend(reversed(line.inserted))
+
+    def __iter__(self):
+        """Iterate over line texts in file order"""
+
+        for line in self.tree():
+            yield line.text
+
+    def add_index(self, line):
+        """Add line to keyword index"""
+
+        if line.key is None:
+            return
+        self.index.setdefault(line.key, []).append(line)
+        if line.key.startswith('set ') and not line.commented:
+            values = line.values()
+            self.variables[line.key[4:]] = values[0].strip() if values else ''
+
+    def remove_index(self, line):
+        """Remove line from keyword index"""
+
+        if line.key is not None:
+            self.index[line.key].remove(line)
+
+    def load_include(self, line):
+        """Parse a sourced conf file"""
+
+        values = line.values()
+        if not values:
+            return
+
+        path = self.substitute(values[0].strip())
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(self.path), path)
+
+        if os.path.isfile(path):
+            include = NamdConf.read(path)
+            self.includes.append((line, include))
+            for name, value in include.variables.items():
+                self.variables.setdefault(name, value)
+
+    def normalize(self, key):
+        """Normalize keyword for lookup"""
+
+        key = ' '.join(key.split())
+        if key.lower().startswith('set '):
+            return 'set ' + key[4:]
+        return key.lower()
+
+    def find(self, key, includes=True):
+        """Find active line for keyword, else a commented one"""
+
+        lines = self.index.get(self.normalize(key), [])
+        for line in lines:
+            if not line.commented:
+                return line
+
+        if includes:
+            for _, include in self.includes:
+                line = include.find(key)
+                if line is not None and not line.commented:
+                    return line
+
+        return lines[0] if lines else None
+
+    def find_all(self, key):
+        """Active lines of keyword in this file and sourced files"""
+
+        lines = [line for line in self.index.get(self.normalize(key), []) if not line.commented]
+        for _, include in self.includes:
+            lines.extend(include.find_all(key))
+        return lines
+
+    def owner(self, line):
+        """Get conf holding line"""
+
+        if line.key in self.index and line in self.index[line.key]:
+            return self
+        # Blank and prose lines are not indexed, such as insert anchors
+        if line.key is None and any(item is line for item in self.tree()):
+            return self
+        for _, include in self.includes:
+            owner = include.owner(line)
+            if owner is not None:
+                return owner
+        return None
+
+    def substitute(self, text):
+        """Replace Tcl variables on text"""
+
+        return VARIABLE.sub(lambda match: self.variables.get(match.group(1) or match.group(2), match.group(0)), text)
+
+    def value(self, key, default=None):
+        """Get first value of an active keyword with variables replaced"""
+
+        line = self.find(key)
+        if line is None or line.commented:
+            return default
+
+        values = line.values()
+        if not values:
+            return default
+        return self.substitute(values[0].split()[0])
+
+    def edit(self, line, text):
+        """Replace the text of a line"""
+
+        owner = self.owner(line)
+        if owner is None:
+            owner = self
+        owner.remove_index(line)
+        line.text = text + line_ending(line.text or self.newline)
+        line.key, line.commented = parse_key(line.text)
+        owner.add_index(line)
+        owner.modified = True
+
+    def insert(self, text, after=None):
+        """Insert a new line after another one, default before the last line"""
+
+        if after is None:
+            after = self.lines[-2] if len(self.lines) > 1 else self.lines[-1]
+
+        # A line after one of a sourced file belongs to that file
+        owner = self.owner(after) or self
+        if not line_ending(after.text):
+            after.text += owner.newline
+
+        line = ConfLine(text + owner.newline if text.strip() else owner.newline)
+        after.inserted.append(line)
+        owner.add_index(line)
+        owner.modified = True
+        return line
+
+    def set(self, text, after=None):
+        """Set option replacing its line in the file that holds it or inserting it"""
+
+        line = self.find(parse_key(text)[0] or text)
+        if line is not None:
+            self.edit(line, text)
+            return line
+        return self.insert(text, after)
+
+    def comment(self, key):
+        """Comment an active option, return False if not found"""
+
+        line = self.find(key)
+        if line is None:
+            return False
+        if not line.commented:
+            self.edit(line, '#' + line.text.rstrip('\r\n'))
+        return True
+
+    def save(self, path):
+        """Write conf file, writing edited sourced files next to it"""
+
+        folder = os.path.dirname(os.path.abspath(path))
+        for source, include in self.includes:
+            if include.modified:
+                target = os.path.join(folder, os.path.basename(include.path))
+                include.save(target)
+                indent = source.text[:len(source.text) - len(source.text.lstrip())]
+                self.edit(source, indent + 'source ' + target)
+
+        with open(path, 'w', newline='') as conf:
+            conf.writelines(self)
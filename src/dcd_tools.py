@@ -0,0 +1,306 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from resolve_restart import get_restart_step
+from color_log import log, setup_logging
+import argparse
+import struct
+import array
+import math
+import mmap
+import sys
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+BLOCK = 64 * 1024 * 1024
+XSC_HEADER = '# NAMD extended system configuration restart file\n' \
+             '#$LABELS step a_x a_y a_z b_x b_y b_z c_x c_y c_z o_x o_y o_z\n'
+
+
+class DcdFile:
+    """Header and frame layout of a CHARMM/NAMD dcd file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+        with open(path, 'rb') as dcd:
+            head = dcd.read(92)
+            if len(head) < 92:
+                raise ValueError(path + ' is not a dcd file')
+
+            for order in ('<', '>'):
+                if struct.unpack(order + 'i', head[:4])[0] == 84 and head[4:8] == b'CORD':
+                    self.order = order
+                    break
+            else:
+                raise ValueError(path + ' is not a dcd file')
+
+            control = struct.unpack(self.order + '20i', head[8:88])
+            self.nset, self.istart, self.nsavc = control[0], control[1], control[2]
+            self.fixed = control[8]
+            self.has_cell = control[10] == 1
+            if control[11] == 1:
+                raise ValueError(path + ' has 4D coordinates, not supported')
+
+            dcd.seek(92)
+            title_size = struct.unpack(self.order + 'i', dcd.read(4))[0]
+            dcd.seek(92 + 4 + title_size + 4)
+            self.natoms = struct.unpack(self.order + 'i', dcd.read(12)[4:8])[0]
+
+        self.header_size = 92 + 4 + title_size + 4 + 12
+        self.coords_size = 3 * (4 * self.natoms + 8)
+        self.cell_size = 56 if self.has_cell else 0
+        self.frame_size = self.cell_size + self.coords_size
+
+    @property
+    def frames(self):
+        """Number of complete frames on file"""
+
+        return max(self.size - self.header_size, 0) // self.frame_size
+
+    def frame_step(self, index):
+        """Step of frame index"""
+
+        return self.istart + index * self.nsavc
+
+    def frames_until(self, step):
+        """Number of frames with step up to step"""
+
+        if step < self.istart:
+            return 0
+        return min(self.frames, (step - self.istart) // self.nsavc + 1)
+
+    def frame_offset(self, index):
+        """Byte offset of frame index"""
+
+        return self.header_size + index * self.frame_size
+
+
+def write_counts(path, dcd, frames, last_step):
+    """Fix NSET and NSTEP on a dcd header"""
+
+    with open(path, 'r+b') as file:
+        file.seek(8)
+        file.write(struct.pack(dcd.order + 'i', frames))
+        file.seek(20)
+        file.write(struct.pack(dcd.order + 'i', last_step))
+
+
+def trim_dcd(path, step):
+    """Cut dcd in place after the frame of step, return kept frames"""
+
+    dcd = DcdFile(path)
+    keep = dcd.frames_until(step)
+
+    if keep == dcd.nset and dcd.size == dcd.frame_offset(keep):
+        return keep
+
+    os.truncate(path, dcd.frame_offset(keep))
+    write_counts(path, dcd, keep, dcd.frame_step(keep - 1) if keep else dcd.istart - dcd.nsavc)
+    log('info', 'Trimmed ' + os.path.basename(path) + ' to ' + str(keep) + ' frames (step ' + str(step) + ').')
+    return keep
+
+
+def copy_frames(source, target, start, end, dcd):
+    """Stream frames start to end from a mapped dcd to target"""
+
+    if end <= start:
+        return
+    with open(source, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        begin, stop = dcd.frame_offset(start), dcd.frame_offset(end)
+        block = max(BLOCK // dcd.frame_size, 1) * dcd.frame_size
+        for offset in range(begin, stop, block):
+            target.write(mapped[offset:min(offset + block, stop)])
+
+
+def merge_dcd(output, paths, last_step=None):
+    """Merge restart segment dcds dropping frames overlapped by the next segment"""
+
+    segments = [DcdFile(path) for path in paths]
+    first = segments[0]
+    for dcd in segments[1:]:
+        if (dcd.natoms, dcd.has_cell, dcd.order) != (first.natoms, first.has_cell, first.order):
+            raise ValueError(dcd.path + ' does not match ' + first.path)
+        if dcd.nsavc != first.nsavc:
+            raise ValueError(dcd.path + ' saves frames every ' + str(dcd.nsavc) + ' steps, ' + first.path +
+                             ' every ' + str(first.nsavc))
+
+    frames = 0
+    step = None
+    with open(output, 'wb') as target:
+        with open(first.path, 'rb') as header:
+            target.write(header.read(first.header_size))
+
+        for index, dcd in enumerate(segments):
+            # Frames past the step the next segment restarted from were redone by it
+            if index + 1 < len(segments):
+                limit = segments[index + 1].istart - 1
+            else:
+                limit = last_step if last_step is not None else dcd.frame_step(dcd.frames - 1)
+
+            start = 0 if step is None else min(dcd.frames_until(step), dcd.frames)
+            end = dcd.frames_until(limit)
+            copy_frames(dcd.path, target, start, end, dcd)
+
+            if end > start:
+                frames += end - start
+                step = dcd.frame_step(end - 1)
+
+    write_counts(output, first, frames, step if step is not None else first.istart)
+    log('info', 'Merged ' + str(len(segments)) + ' dcd files with ' + str(frames) + ' frames on ' + output + '.')
+    return frames
+
+
+def frame_complete(mapped, dcd, index):
+    """Check record markers and values of a frame"""
+
+    offset = dcd.frame_offset(index)
+    records = [48] if dcd.has_cell else []
+    records += [4 * dcd.natoms] * 3
+    for size in records:
+        head, tail = struct.unpack(dcd.order + 'i', mapped[offset:offset + 4])[0], \
+            struct.unpack(dcd.order + 'i', mapped[offset + 4 + size:offset + 8 + size])[0]
+        if head != size or tail != size:
+            return False
+        offset += size + 8
+
+    # A frame cut by a crash may still have its markers, check the last atom is finite
+    last = struct.unpack(dcd.order + 'f', mapped[offset - 8:offset - 4])[0]
+    return math.isfinite(last)
+
+
+def last_frame(dcd, lookback=10):
+    """Index of the last complete frame on dcd or None"""
+
+    if dcd.fixed:
+        raise ValueError(dcd.path + ' has fixed atoms, not supported')
+    if not dcd.frames:
+        return None
+
+    with open(dcd.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for index in range(dcd.frames - 1, max(dcd.frames - 1 - lookback, -1), -1):
+            if frame_complete(mapped, dcd, index):
+                return index
+    return None
+
+
+def read_axis(mapped, offset, dcd):
+    """Float32 coordinates of one axis record as doubles"""
+
+    data = mapped[offset + 4:offset + 4 + 4 * dcd.natoms]
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype=dcd.order + 'f4').astype('f8')
+
+    values = array.array('f', data)
+    if (dcd.order == '<') != (sys.byteorder == 'little'):
+        values.byteswap()
+    return array.array('d', values)
+
+
+def cell_vectors(cell):
+    """Get a, b and c vectors from a dcd unit cell record (a, gamma, b, beta, alpha, c)"""
+
+    a, gamma, b, beta, alpha, c = cell
+    # Namd stores angle cosines, charmm stores degrees
+    cosines = [angle if abs(angle) <= 1 else math.cos(math.radians(angle)) for angle in (gamma, beta, alpha)]
+    cos_gamma, cos_beta, cos_alpha = cosines
+    sin_gamma = math.sqrt(max(1 - cos_gamma ** 2, 0)) or 1.0
+
+    c_y = (cos_alpha - cos_beta * cos_gamma) / sin_gamma
+    c_z = math.sqrt(max(1 - cos_beta ** 2 - c_y ** 2, 0))
+    return [a, 0.0, 0.0], [b * cos_gamma, b * sin_gamma, 0.0], [c * cos_beta, c * c_y, c * c_z]
+
+
+def write_frame_restart(dcd, index, coor_path, xsc_path, step, origin=(0.0, 0.0, 0.0)):
+    """Write a namd binary coor and an xsc from a dcd frame"""
+
+    with open(dcd.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        offset = dcd.frame_offset(index)
+        cell = None
+        if dcd.has_cell:
+            cell = struct.unpack(dcd.order + '6d', mapped[offset + 4:offset + 52])
+            offset += dcd.cell_size
+        axes = [read_axis(mapped, offset + axis * (4 * dcd.natoms + 8), dcd) for axis in range(3)]
+
+    # Namd binary files hold the atom count and xyz doubles per atom, in native order
+    if numpy is not None:
+        coords = numpy.stack(axes, axis=1).astype('=f8').tobytes()
+    else:
+        coords = array.array('d', bytes(24 * dcd.natoms))
+        for axis in range(3):
+            coords[axis::3] = axes[axis]
+        coords = coords.tobytes()
+    with open(coor_path, 'wb') as coor:
+        coor.write(struct.pack('=i', dcd.natoms))
+        coor.write(coords)
+
+    vectors = cell_vectors(cell) if cell else [[0.0] * 3] * 3
+    values = [str(step)] + [format(value, '.15g') for vector in vectors for value in vector] + \
+             [format(float(value), '.15g') for value in origin]
+    with open(xsc_path, 'w') as xsc:
+        xsc.write(XSC_HEADER + ' '.join(values) + '\n')
+
+
+def main():
+    """Command line for trimming and merging dcd files"""
+
+    parser = argparse.ArgumentParser(description='Trim and merge namd dcd trajectories across restarts.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    trim = commands.add_parser('trim', help='Cut a dcd in place after a restart step')
+    trim.add_argument('dcd')
+    trim.add_argument('step', help='Restart step or restart .xsc file to take it from')
+
+    merge = commands.add_parser('merge', help='Merge restart segment dcds in order')
+    merge.add_argument('output')
+    merge.add_argument('dcd', nargs='+')
+    merge.add_argument('--last-step', type=int, help='Drop frames after this step on the last segment')
+
+    frame = commands.add_parser('frame', help='Write <prefix>.coor and <prefix>.xsc from the last complete frame')
+    frame.add_argument('dcd')
+    frame.add_argument('prefix')
+
+    args = parser.parse_args()
+    setup_logging()
+    if args.command == 'trim':
+        step = get_restart_step({'xsc': args.step}) if args.step.endswith('.xsc') else args.step
+        if step:
+            trim_dcd(args.dcd, int(step))
+    elif args.command == 'merge':
+        merge_dcd(args.output, args.dcd, args.last_step)
+    else:
+        dcd = DcdFile(args.dcd)
+        index = last_frame(dcd)
+        if index is None:
+            log('error', 'No complete frame on ' + args.dcd + '.')
+            return
+        write_frame_restart(dcd, index, args.prefix + '.coor', args.prefix + '.xsc', dcd.frame_step(index))
+        log('info', 'Wrote frame ' + str(index + 1) + ' (step ' + str(dcd.frame_step(index)) + ') to ' +
+            args.prefix + '.coor.')
+
+
+if __name__ == '__main__':
+    main()
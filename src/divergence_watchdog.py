@@ -0,0 +1,138 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from log_monitor import LogTailer, write_atomic
+from color_log import log
+from time import time
+import threading
+import json
+import math
+
+
+POLL = 1
+
+
+class DivergenceWatchdog:
+    """Check ENERGY lines of a running namd against divergence rules and stop it on the first broken one"""
+
+    def __init__(self, jump=0.1, temperature=None, pressure=None):
+        self.jump = jump
+        self.temperature = temperature
+        self.pressure = pressure
+        self.fields = None
+        self.last_total = None
+        self.triggered = None
+        self.process = None
+        self.tailer = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def feed(self, line):
+        """Check one output line"""
+
+        if self.triggered:
+            return
+        if line.startswith('ETITLE:'):
+            self.fields = line.split()[1:]
+            return
+        if not line.startswith('ENERGY:') or not self.fields:
+            return
+
+        values = line.split()[1:]
+        if len(values) != len(self.fields):
+            return
+        try:
+            energy = dict(zip(self.fields, map(float, values)))
+        except ValueError:
+            return
+
+        rule = self.check(energy)
+        if rule:
+            self.trigger(energy, rule)
+
+    def check(self, energy):
+        """Get the first broken rule for an ENERGY line or None"""
+
+        if not all(math.isfinite(value) for value in energy.values()):
+            return 'non finite energy'
+
+        total, last = energy.get('TOTAL'), self.last_total
+        self.last_total = total
+        if total is not None and last is not None and abs(total - last) > self.jump * max(abs(last), 1.0):
+            return 'total energy jumped from ' + format(last, 'g') + ' to ' + format(total, 'g')
+
+        for field, band in (('TEMP', self.temperature), ('PRESSURE', self.pressure)):
+            if band and field in energy and not band[0] <= energy[field] <= band[1]:
+                return field.lower() + ' ' + format(energy[field], 'g') + ' outside ' + \
+                    format(band[0], 'g') + '-' + format(band[1], 'g')
+        return None
+
+    def trigger(self, energy, rule):
+        """Record the divergence and terminate namd"""
+
+        self.triggered = {'step': int(energy.get('TS', 0)), 'rule': rule, 'time': time(),
+                          'energy': {field: energy[field] for field in ('TOTAL', 'TEMP', 'PRESSURE')
+                                     if field in energy and math.isfinite(energy[field])}}
+        log('warning', 'Divergence at step ' + str(self.triggered['step']) + ': ' + rule + '. Terminating namd.')
+        if self.process is not None:
+            self.process.terminate()
+
+    def attach(self, process):
+        """Terminate process on divergence, also when it was found before"""
+
+        self.process = process
+        if self.triggered and process.poll() is None:
+            process.terminate()
+
+    def start(self, log_file):
+        """Follow a log file in background"""
+
+        self.tailer = LogTailer(log_file, self)
+        self.thread = threading.Thread(target=self.follow, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop following"""
+
+        if self.thread:
+            self.stop_event.set()
+            self.thread.join()
+
+    def follow(self):
+        """Check new log lines every second until stopped"""
+
+        while not self.stop_event.wait(POLL) and not self.triggered:
+            self.tailer.poll()
+
+
+def record_intervention(path, intervention):
+    """Append an intervention to a json audit file"""
+
+    try:
+        with open(path) as audit:
+            interventions = json.load(audit)
+    except (OSError, ValueError):
+        interventions = list()
+
+    interventions.append(intervention)
+    try:
+        write_atomic(path, json.dumps(interventions, indent=1))
+    except OSError as error:
+        log('warning', 'Could not write watchdog audit: ' + str(error))
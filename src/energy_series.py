@@ -0,0 +1,279 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from log_capture import is_archive, summary_of, open_log
+from color_log import log, setup_logging
+from bisect import bisect_left
+from array import array
+import argparse
+import json
+import mmap
+import sys
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+META_FILE = 'meta.json'
+FLUSH_ROWS = 8192
+NAN = float('nan')
+
+
+def first_energy_step(path):
+    """Step of the first ENERGY line of a log, reading only up to it"""
+
+    with open_log(path) as log_file:
+        for line in log_file:
+            if line.startswith(b'ENERGY:'):
+                try:
+                    return int(line.split()[1])
+                except (IndexError, ValueError):
+                    continue
+    return None
+
+
+def find_logs(paths):
+    """Namd logs of paths (files or folders) ordered by first energy step"""
+
+    logs = list()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                logs.extend(os.path.join(root, file) for file in files if file.endswith('.log') or is_archive(file))
+        else:
+            logs.append(path)
+
+    # Captured logs are read from their compressed parts, not their summary
+    logs = set(map(os.path.abspath, logs))
+    logs -= {summary_of(path) for path in logs if is_archive(path)}
+
+    ordered = list()
+    for path in logs:
+        step = first_energy_step(path)
+        if step is not None:
+            ordered.append((step, os.path.getmtime(path), path))
+    return [path for _, _, path in sorted(ordered)]
+
+
+class EnergySeries:
+    """ENERGY fields of a restart lineage stored as one float64 file per column"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.meta_file = os.path.join(folder, META_FILE)
+        try:
+            with open(self.meta_file) as meta:
+                self.meta = json.load(meta)
+        except (OSError, ValueError):
+            self.meta = {'fields': [], 'rows': 0, 'logs': [], 'byteorder': sys.byteorder}
+        self.buffer = None
+
+    def column_file(self, field):
+        """Path of a column file"""
+
+        return os.path.join(self.folder, field + '.f64')
+
+    def save_meta(self):
+        """Write metadata atomically"""
+
+        with open(self.meta_file + '.tmp', 'w') as meta:
+            json.dump(self.meta, meta, indent=1)
+        os.replace(self.meta_file + '.tmp', self.meta_file)
+
+    def reset(self):
+        """Drop all rows"""
+
+        for field in self.meta['fields']:
+            try:
+                os.remove(self.column_file(field))
+            except FileNotFoundError:
+                pass
+        self.meta = {'fields': [], 'rows': 0, 'logs': [], 'byteorder': sys.byteorder}
+
+    def add_fields(self, fields):
+        """Create missing columns filled with nan for existing rows"""
+
+        for field in fields:
+            if field in self.meta['fields']:
+                continue
+            with open(self.column_file(field), 'wb') as column:
+                remaining = self.meta['rows']
+                while remaining:
+                    rows = min(remaining, FLUSH_ROWS)
+                    (array('d', [NAN]) * rows).tofile(column)
+                    remaining -= rows
+            self.meta['fields'].append(field)
+            if self.buffer is not None:
+                self.buffer[field] = array('d', [NAN]) * len(self.buffer['TS'])
+
+    def truncate(self, step):
+        """Drop rows from step on, return rows kept"""
+
+        self.flush()
+        steps = self.read_column('TS')
+        keep = bisect_left(steps, step) if steps is not None else 0
+        if keep < self.meta['rows']:
+            for field in self.meta['fields']:
+                os.truncate(self.column_file(field), keep * 8)
+            self.meta['rows'] = keep
+        return keep
+
+    def append(self, values):
+        """Buffer one row of {field: value}"""
+
+        if self.buffer is None:
+            self.buffer = {field: array('d') for field in self.meta['fields']}
+        for field, column in self.buffer.items():
+            column.append(values.get(field, NAN))
+        if len(self.buffer['TS']) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Append buffered rows to column files"""
+
+        if not self.buffer or not len(self.buffer['TS']):
+            return
+        for field, column in self.buffer.items():
+            with open(self.column_file(field), 'ab') as file:
+                column.tofile(file)
+        self.meta['rows'] += len(self.buffer['TS'])
+        self.buffer = None
+
+    def read_column(self, field):
+        """Memory map one column (native byte order), as numpy array when available"""
+
+        path = self.column_file(field)
+        if field not in self.meta['fields'] or not self.meta['rows']:
+            return None
+        if numpy is not None:
+            return numpy.memmap(path, dtype='f8', mode='r', shape=(self.meta['rows'],))
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), self.meta['rows'] * 8, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast('d')
+
+    def ingest(self, path, offset=0, fields=None):
+        """Stream ENERGY lines of a log from offset, return offset after the last full line and fields"""
+
+        # Compressed log parts can not be resumed, they are read again and rewrite their own rows
+        archive = is_archive(path)
+        if archive:
+            offset = 0
+
+        with open_log(path) as log_file:
+            log_file.seek(offset)
+            try:
+                for line in log_file:
+                    if not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+
+                    if line.startswith(b'ETITLE:'):
+                        fields = line.decode(errors='replace').split()[1:]
+                        self.add_fields(fields)
+                    elif line.startswith(b'ENERGY:') and fields:
+                        values = line.split()[1:]
+                        if len(values) != len(fields):
+                            continue
+                        try:
+                            row = dict(zip(fields, map(float, values)))
+                        except ValueError:
+                            continue
+                        # A later restart rewrites the steps it shares with the run before
+                        if self.meta['rows'] or self.buffer:
+                            last = self.buffer['TS'][-1] if self.buffer and len(self.buffer['TS']) else self.last_step()
+                            if row['TS'] <= last:
+                                self.truncate(row['TS'])
+                        self.append(row)
+            except EOFError:
+                # Part still being written by a running log capture
+                pass
+
+        self.flush()
+        return (os.path.getsize(path) if archive else offset), fields
+
+    def last_step(self):
+        """Step of the last stored row"""
+
+        steps = self.read_column('TS')
+        return steps[-1] if steps is not None else -1
+
+    def update(self, logs):
+        """Add new logs and lines appended to known ones, in lineage order"""
+
+        os.makedirs(self.folder, exist_ok=True)
+        known = [entry['path'] for entry in self.meta['logs']]
+
+        # Appending is only safe when known logs are an unchanged prefix of the lineage and
+        # only the newest of them grew, older lines would land after newer rows
+        grown = [entry['path'] for entry in self.meta['logs'][:-1]
+                 if not os.path.exists(entry['path']) or os.path.getsize(entry['path']) != entry['offset']]
+        last = self.meta['logs'][-1] if self.meta['logs'] else None
+        if known != logs[:len(known)] or grown or (last and os.path.getsize(last['path']) < last['offset']):
+            if known:
+                log('info', 'Log lineage changed. Rebuilding energy series.')
+            self.reset()
+
+        offsets = {entry['path']: entry for entry in self.meta['logs']}
+        for path in logs:
+            entry = offsets.get(path)
+            if entry is None:
+                entry = {'path': path, 'offset': 0, 'fields': None}
+                self.meta['logs'].append(entry)
+            if os.path.getsize(path) == entry['offset']:
+                continue
+            entry['offset'], entry['fields'] = self.ingest(path, entry['offset'], entry['fields'])
+            self.save_meta()
+
+        self.save_meta()
+        log('info', 'Energy series has ' + str(self.meta['rows']) + ' steps from ' + str(len(logs)) + ' logs.')
+        return self.meta['rows']
+
+    def export_npz(self, path):
+        """Write all columns to a compressed numpy archive"""
+
+        if numpy is None:
+            log('error', 'Numpy is required to export .npz files.')
+            return False
+        numpy.savez_compressed(path, **{field: numpy.asarray(self.read_column(field))
+                                        for field in self.meta['fields'] if self.meta['rows']})
+        return True
+
+
+def main():
+    """Command line for extracting energy series"""
+
+    parser = argparse.ArgumentParser(description='Extract namd ENERGY fields of restart logs to column files.')
+    parser.add_argument('output', help='Series folder, updated in place on later runs')
+    parser.add_argument('logs', nargs='+', help='Log files or folders searched for .log files')
+    parser.add_argument('--npz', help='Also export series to a .npz file')
+    args = parser.parse_args()
+    setup_logging()
+
+    series = EnergySeries(args.output)
+    series.update(find_logs(args.logs))
+    if args.npz:
+        series.export_npz(args.npz)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from log_monitor import NamdLogParser
+from restart_validator import read_header
+from color_log import log
+from time import perf_counter
+import tempfile
+import math
+import os
+
+
+PROBE_MIN = 4 * 1024 * 1024
+PROBE_MAX = 64 * 1024 * 1024
+LOG_TAIL = 2 * 1024 * 1024
+MIN_INTERVAL = 300
+
+
+def restart_set_size(restart_files):
+    """Bytes written for one restart set"""
+
+    return sum(os.path.getsize(file) for file in restart_files.values())
+
+
+def existing_folder(path):
+    """Nearest existing folder of path"""
+
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def probe_throughput(folder, size):
+    """Write and sync size bytes on folder, return bytes per second"""
+
+    size = int(min(max(size, PROBE_MIN), PROBE_MAX))
+    block = os.urandom(1024 * 1024)
+    fd, path = tempfile.mkstemp(prefix='.io_probe_', dir=existing_folder(folder))
+    try:
+        start = perf_counter()
+        written = 0
+        while written < size:
+            written += os.write(fd, block[:size - written])
+        os.fsync(fd)
+        return size / max(perf_counter() - start, 1e-6)
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def newest_log(folder):
+    """Most recently written .log file on folder"""
+
+    logs = [entry for entry in os.scandir(folder) if entry.is_file() and entry.name.endswith('.log')]
+    if not logs:
+        return None
+    return max(logs, key=lambda entry: entry.stat().st_mtime).path
+
+
+def step_seconds(log_file):
+    """Wall seconds per step from the last TIMING lines of a log"""
+
+    parser = NamdLogParser()
+    with open(log_file, 'rb') as file:
+        file.seek(max(os.path.getsize(log_file) - LOG_TAIL, 0))
+        for line in file:
+            if line.startswith(b'TIMING:'):
+                parser.feed(line.decode(errors='replace'))
+    return parser.seconds_per_step
+
+
+def optimal_interval(write_seconds, mtbf):
+    """Young/Daly checkpoint interval in seconds"""
+
+    if write_seconds >= mtbf / 2:
+        return mtbf
+    return math.sqrt(2 * write_seconds * mtbf) - write_seconds
+
+
+def round_steps(steps, multiple):
+    """Round steps to a positive multiple"""
+
+    return max(int(round(steps / multiple)) * multiple, multiple)
+
+
+def io_overhead(write_seconds, frequency, seconds_per_step):
+    """Fraction of wall time spent writing every frequency steps"""
+
+    return write_seconds / (frequency * seconds_per_step + write_seconds)
+
+
+def lost_work(frequency, seconds_per_step, mtbf):
+    """Expected fraction of wall time redone after failures"""
+
+    return frequency * seconds_per_step / 2 / mtbf
+
+
+def percent(fraction):
+    """Format fraction as percent"""
+
+    return format(fraction * 100, '.2f') + '%'
+
+
+def advise_io(conf_file, restart_files, output_folder, previous_folder, mtbf_hours=24, budget=0.02):
+    """Recommend restartfreq and dcdfreq for output folder storage, return {option: frequency}"""
+
+    log_file = newest_log(previous_folder)
+    seconds_per_step = step_seconds(log_file) if log_file else None
+    if not seconds_per_step:
+        log('warning', 'No TIMING lines on previous log. Skipping I/O advisor.')
+        return dict()
+
+    restart_bytes = restart_set_size(restart_files)
+    throughput = probe_throughput(output_folder, restart_bytes)
+    mtbf = mtbf_hours * 3600
+    cycle = conf_file.value('stepspercycle', '20')
+    multiple = int(cycle) if cycle.isdigit() else 20
+
+    log('info', 'I/O advisor: restart set ' + format(restart_bytes / 1e6, '.1f') + ' MB, storage ' +
+        format(throughput / 1e6, '.1f') + ' MB/s, ' + format(seconds_per_step, '.4f') + ' s/step.')
+
+    advice = dict()
+
+    # Restart writes balance write time against work redone after a failure
+    write_seconds = restart_bytes / throughput
+    recommended = round_steps(optimal_interval(write_seconds, mtbf) / seconds_per_step, multiple)
+
+    # Fast storage gives intervals of a few steps, keep restarts at least minutes of wall time apart
+    floor = math.ceil(MIN_INTERVAL / seconds_per_step / multiple) * multiple
+    if recommended < floor:
+        log('info', 'Young/Daly restartfreq ' + str(recommended) + ' is under ' + format(MIN_INTERVAL / 60, 'g') +
+            ' min of wall time, using ' + str(floor) + '.')
+        recommended = floor
+
+    current = conf_file.value('restartfreq')
+    if current and current.isdigit() and int(current) > 0:
+        current = int(current)
+        log('info', 'restartfreq ' + str(current) + ' -> ' + str(recommended) + ': I/O overhead ' +
+            percent(io_overhead(write_seconds, current, seconds_per_step)) + ' -> ' +
+            percent(io_overhead(write_seconds, recommended, seconds_per_step)) + ', expected lost work ' +
+            percent(lost_work(current, seconds_per_step, mtbf)) + ' -> ' +
+            percent(lost_work(recommended, seconds_per_step, mtbf)) + ' (MTBF ' + format(mtbf_hours, 'g') + 'h).')
+    else:
+        log('info', 'restartfreq not set -> ' + str(recommended) + ': I/O overhead ' +
+            percent(io_overhead(write_seconds, recommended, seconds_per_step)) + ', expected lost work ' +
+            percent(lost_work(recommended, seconds_per_step, mtbf)) + ' (MTBF ' + format(mtbf_hours, 'g') + 'h).')
+    if isinstance(current, int) and recommended < current:
+        log('info', 'Lowering restartfreq: restarts every ' + format(current * seconds_per_step / 60, '.1f') +
+            ' min would redo more work after a failure than the ' + format(write_seconds, '.2f') +
+            ' s writes of ' + str(recommended) + ' steps cost.')
+    if recommended != current:
+        advice['restartfreq'] = recommended
+
+    # Trajectory frequency is a science choice, only relax it when over the budget
+    header = read_header(restart_files['coor'])
+    current = conf_file.value('dcdfreq')
+    if header and current and current.isdigit() and int(current) > 0:
+        current = int(current)
+        frame_seconds = (12 * header[0] + 80) / throughput
+        overhead = io_overhead(frame_seconds, current, seconds_per_step)
+        recommended = current
+        if overhead > budget:
+            needed = frame_seconds * (1 - budget) / (budget * seconds_per_step)
+            recommended = math.ceil(needed / current) * current
+            advice['dcdfreq'] = recommended
+        log('info', 'dcdfreq ' + str(current) + ' -> ' + str(recommended) + ': I/O overhead ' + percent(overhead) +
+            ' -> ' + percent(io_overhead(frame_seconds, recommended, seconds_per_step)) + '.')
+
+    return advice
@@ -0,0 +1,213 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from backup_store import COMPRESSORS
+from collections import deque
+import threading
+import re
+import os
+
+
+CHUNK = 1024 * 1024
+TAIL_LINES = 200
+STARTUP_LINES = 5000
+ERROR_BYTES = 64 * 1024
+ARCHIVE = re.compile(r'\.log\.\d+\.(gz|bz2|xz)$')
+SUMMARY = (b'TIMING:', b'WallClock:', b'WRITING', b'Warning', b'WARNING', b'ERROR', b'FATAL', b'Reason:')
+FEED = (b'ENERGY:', b'ETITLE:', b'TIMING:', b'WallClock:')
+
+
+def is_archive(path):
+    """Check path is a compressed part of a captured log"""
+
+    return ARCHIVE.search(path) is not None
+
+
+def summary_of(path):
+    """Summary log of a compressed log part"""
+
+    return ARCHIVE.sub('.log', path)
+
+
+def open_log(path):
+    """Open a log or a compressed log part for binary reading"""
+
+    match = ARCHIVE.search(path)
+    if not match:
+        return open(path, 'rb')
+
+    modules = {suffix: module for module, suffix in COMPRESSORS.values()}
+    return __import__(modules['.' + match.group(1)]).open(path, 'rb')
+
+
+class LogCapture:
+    """Write namd output chunks into compressed log parts, a summary log and an in memory tail"""
+
+    def __init__(self, log_file, err_file, compress='gzip', rotate_mb=1024):
+        self.log_file = log_file
+        self.err_file = err_file
+        self.module = __import__(COMPRESSORS[compress][0])
+        self.suffix = COMPRESSORS[compress][1]
+        self.rotate = int(rotate_mb * 1024 * 1024)
+        self.listeners = list()
+        self.tail = deque(maxlen=TAIL_LINES)
+        self.errors = b''
+        self.title = None
+        self.part = 0
+        self.archive = None
+        self.written = 0
+        self.summary = None
+        self.err = None
+        self.partial = b''
+        self.startup = True
+        self.kept = 0
+
+    def open(self):
+        """Open the first log part, the summary log and the err file"""
+
+        self.open_part()
+        self.summary = open(self.log_file, 'wb')
+        self.err = open(self.err_file, 'wb')
+
+    def close(self):
+        """Close log files ending the summary with the output tail, return captured error text"""
+
+        if self.partial:
+            self.tail.append(self.partial)
+        self.archive.close()
+
+        # The tail keeps the context of how the run ended
+        self.summary.write(b'------------- Last ' + str(len(self.tail)).encode() + b' lines of output -------------\n')
+        self.summary.write(b'\n'.join(self.tail) + b'\n')
+        self.summary.close()
+        self.err.close()
+        return self.error_text()
+
+    def error_text(self):
+        """Captured stderr and fatal lines of the output tail"""
+
+        fatal = [line for line in self.tail if b'FATAL ERROR' in line]
+        return b'\n'.join(([self.errors] if self.errors else []) + fatal).decode(errors='replace')
+
+    def open_part(self):
+        """Start the next compressed log part, repeating the energy title"""
+
+        if self.archive:
+            self.archive.close()
+        self.part += 1
+        self.archive = self.module.open(self.log_file + '.' + str(self.part) + self.suffix, 'wb')
+        self.written = 0
+        if self.title:
+            self.archive.write(self.title)
+
+    def store(self, data):
+        """Write output to compressed parts, rotating on a line end"""
+
+        if self.written + len(data) > self.rotate:
+            cut = data.rfind(b'\n') + 1
+            if cut:
+                self.archive.write(data[:cut])
+                self.open_part()
+                data = data[cut:]
+
+        self.archive.write(data)
+        self.written += len(data)
+
+    def filter(self, lines):
+        """Keep startup, timing and warning lines on summary and feed listeners"""
+
+        for line in lines:
+            self.tail.append(line)
+            if line.startswith(FEED):
+                if line.startswith(b'ETITLE:'):
+                    self.title = line + b'\n'
+                    self.startup = False
+                for listener in self.listeners:
+                    listener(line.decode(errors='replace'))
+
+            if self.startup or line.startswith(SUMMARY):
+                self.summary.write(line + b'\n')
+
+    def write_output(self, data):
+        """Split a chunk of namd stdout in compressed parts and the summary log"""
+
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        self.filter(lines)
+        self.startup = self.startup and self.kept < STARTUP_LINES
+        self.kept += len(lines)
+        self.store(data)
+        self.summary.flush()
+
+    def write_errors(self, data):
+        """Copy a chunk of namd stderr to the err file keeping its end in memory"""
+
+        self.err.write(data)
+        self.err.flush()
+        self.errors = (self.errors + data)[-ERROR_BYTES:]
+
+
+class PipeCapture(LogCapture):
+    """Capture namd output from os pipes read by one thread each"""
+
+    def __init__(self, log_file, err_file, compress='gzip', rotate_mb=1024):
+        super().__init__(log_file, err_file, compress, rotate_mb)
+        self.started = False
+        self.out_read, self.out_write = os.pipe()
+        self.err_read, self.err_write = os.pipe()
+        self.threads = [threading.Thread(target=self.read_pipe, args=(self.out_read, self.write_output), daemon=True),
+                        threading.Thread(target=self.read_pipe, args=(self.err_read, self.write_errors), daemon=True)]
+
+    def start(self):
+        """Start reading once namd holds the write ends"""
+
+        self.close_writers()
+        self.open()
+        self.started = True
+        for thread in self.threads:
+            thread.start()
+
+    def close_writers(self):
+        """Close write ends kept by this process so readers see namd exit"""
+
+        for fd in (self.out_write, self.err_write):
+            if fd is not None:
+                os.close(fd)
+        self.out_write = self.err_write = None
+
+    def finish(self):
+        """Wait for namd output to end, return captured error text"""
+
+        self.close_writers()
+        if not self.started:
+            os.close(self.out_read)
+            os.close(self.err_read)
+            return ''
+
+        for thread in self.threads:
+            thread.join()
+        return self.close()
+
+    def read_pipe(self, fd, write):
+        """Pass pipe chunks to write until namd closes it"""
+
+        with open(fd, 'rb', buffering=0) as pipe:
+            for data in iter(lambda: pipe.read(CHUNK), b''):
+                write(data)
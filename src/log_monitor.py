@@ -0,0 +1,213 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from color_log import log
+from time import time
+import threading
+import json
+import re
+import os
+
+
+TIMING = re.compile(r'TIMING:\s+(\d+).*Wall:\s+([\d.eE+-]+),\s+([\d.eE+-]+)/step')
+WALLCLOCK = re.compile(r'WallClock:\s+([\d.eE+-]+)')
+
+
+class NamdLogParser:
+    """Parse namd output lines into run metrics"""
+
+    def __init__(self, timestep=1.0, first_step=0, target_step=None):
+        self.timestep = float(timestep)
+        self.first_step = int(first_step)
+        self.target_step = target_step
+        self.fields = None
+        self.energy = dict()
+        self.step = self.first_step
+        self.seconds_per_step = None
+        self.wall = None
+        self.wallclock = None
+        self.updated = None
+
+    def feed(self, line):
+        """Parse one output line, return parsed kind or None"""
+
+        if line.startswith('ENERGY:'):
+            values = line.split()[1:]
+            if self.fields and len(values) == len(self.fields):
+                try:
+                    self.energy = dict(zip(self.fields, map(float, values)))
+                except ValueError:
+                    self.energy = dict(zip(self.fields, values))
+                self.step = int(values[0])
+                self.updated = time()
+                return 'energy'
+
+        elif line.startswith('ETITLE:'):
+            self.fields = line.split()[1:]
+            return 'etitle'
+
+        elif line.startswith('TIMING:'):
+            match = TIMING.match(line)
+            if match:
+                self.step = int(match.group(1))
+                self.wall = float(match.group(2))
+                self.seconds_per_step = float(match.group(3))
+                self.updated = time()
+                return 'timing'
+
+        elif line.startswith('WallClock:'):
+            match = WALLCLOCK.match(line)
+            if match:
+                self.wallclock = float(match.group(1))
+                return 'wallclock'
+
+        return None
+
+    def metrics(self):
+        """Current run metrics"""
+
+        metrics = {'step': self.step, 'first_step': self.first_step, 'target_step': self.target_step,
+                   'steps_per_second': None, 'ns_per_day': None, 'eta_seconds': None,
+                   'wallclock': self.wallclock, 'updated': self.updated}
+
+        if self.seconds_per_step:
+            metrics['steps_per_second'] = 1 / self.seconds_per_step
+            metrics['ns_per_day'] = 86400 / self.seconds_per_step * self.timestep * 1e-6
+            if self.target_step is not None:
+                metrics['eta_seconds'] = max(self.target_step - self.step, 0) * self.seconds_per_step
+
+        for field in ('TOTAL', 'TEMP', 'PRESSURE'):
+            if field in self.energy:
+                metrics[field.lower()] = self.energy[field]
+
+        return metrics
+
+
+class LogTailer:
+    """Feed new lines of a growing log to a parser"""
+
+    def __init__(self, path, parser):
+        self.path = path
+        self.parser = parser
+        self.offset = 0
+        self.partial = b''
+
+    def poll(self):
+        """Read lines appended since last poll"""
+
+        try:
+            with open(self.path, 'rb') as log_file:
+                log_file.seek(self.offset)
+                data = log_file.read()
+        except FileNotFoundError:
+            return 0
+
+        self.offset += len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+
+        for line in lines:
+            self.parser.feed(line.decode(errors='replace'))
+        return len(lines)
+
+
+def write_atomic(path, text):
+    """Write text file through a rename so readers never see it partial"""
+
+    with open(path + '.tmp', 'w') as file:
+        file.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def prometheus_text(metrics, name):
+    """Format metrics as prometheus textfile"""
+
+    gauges = {
+        'namd_step': metrics['step'],
+        'namd_target_step': metrics['target_step'],
+        'namd_steps_per_second': metrics['steps_per_second'],
+        'namd_ns_per_day': metrics['ns_per_day'],
+        'namd_eta_seconds': metrics['eta_seconds'],
+        'namd_last_update_timestamp_seconds': metrics['updated'],
+    }
+
+    lines = list()
+    for gauge, value in gauges.items():
+        if value is None:
+            continue
+        lines.append('# TYPE ' + gauge + ' gauge')
+        lines.append(gauge + '{name="' + name + '"} ' + repr(float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class LogMonitor:
+    """Follow a namd log and export its status periodically"""
+
+    def __init__(self, log_file, output_name, parser, metrics_dir=None, interval=30):
+        self.name = os.path.basename(output_name)
+        self.status_file = output_name + '.status.json'
+        self.prom_file = os.path.join(metrics_dir or os.path.dirname(output_name), 'namd_' + self.name + '.prom')
+        self.parser = parser
+        self.tailer = LogTailer(log_file, parser) if log_file else None
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.follow, daemon=True)
+
+    @classmethod
+    def from_conf(cls, conf_file, log_file, output_name, metrics_dir=None, interval=30):
+        """Create monitor with timestep and target step from a NamdConf"""
+
+        first_step = int(conf_file.value('firsttimestep', 0))
+        run = conf_file.value('run')
+        target_step = first_step + int(run) if run and run.isdigit() else None
+        parser = NamdLogParser(conf_file.value('timestep', 1), first_step, target_step)
+        return cls(log_file, output_name, parser, metrics_dir, interval)
+
+    def start(self):
+        """Start following in background"""
+
+        self.thread.start()
+
+    def stop(self):
+        """Stop following and export the final status"""
+
+        self.stop_event.set()
+        self.thread.join()
+        self.update()
+
+    def update(self):
+        """Parse new lines and export status"""
+
+        # Without a log file lines are fed to the parser by a log capture
+        if self.tailer:
+            self.tailer.poll()
+        metrics = self.parser.metrics()
+        metrics['name'] = self.name
+        try:
+            write_atomic(self.status_file, json.dumps(metrics, indent=1))
+            write_atomic(self.prom_file, prometheus_text(metrics, self.name))
+        except OSError as error:
+            log('warning', 'Could not write metrics: ' + str(error))
+
+    def follow(self):
+        """Export status every interval"""
+
+        while not self.stop_event.wait(self.interval):
+            self.update()
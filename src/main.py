@@ -19,82 +19,261 @@
 """
 
 from arguments_parser import make_parser
-from prepare_dynamic import format_option, finish_dynamic, write_backup
-from resolve_restart import search_previous, get_restart_step
-from color_log import log
+from prepare_dynamic import format_option, finish_dynamic, namd_command
+from backup_store import BackupStore
+from conf_model import NamdConf
+from log_monitor import LogMonitor
+from restart_validator import psf_atoms, read_header
+from autotune import autotune
+from chain import RestartChain
+from dcd_tools import DcdFile, trim_dcd, last_frame, write_frame_restart
+from energy_series import EnergySeries, find_logs
+from io_advisor import advise_io
+from staging import Stage, forward_sigterm
+from log_capture import PipeCapture
+from divergence_watchdog import DivergenceWatchdog, record_intervention
+from scheduler import get_backend, make_job, unsupervised_options
+from resolve_restart import search_previous, get_restart_step, index_restart, resolve_restart, stage_files, \
+    restart_stages, pick_stage, INDEX_FILE
+from restart_watcher import RestartWatcher
+from batch_restart import run_batch
+from restart_daemon import RestartDaemon
+from color_log import log, setup_logging
+from timing import PhaseTimer
 import os
 from time import sleep
 import subprocess
+import logging
+import signal
+
+
+class RestartResult:
+    """Outcome of preparing a restart"""
+
+    def __init__(self):
+        self.success = False
+        self.restart_files = None
+        self.restart_step = None
+        self.run_steps = None
+        self.conf_text = None
+        self.conf_path = None
+
+    def as_dict(self):
+        """Result as a plain dict"""
+
+        return dict(vars(self))
 
 
 class DynamicRestart:
     """Automatically restarts namd dynamics"""
 
     def __init__(self, **kwargs):
-        self.conf = kwargs['conf']
-        self.backup = kwargs['backup']
-        self.namd = kwargs['namd']
-        self.namd_exe = kwargs['namd_exe']
-        self.options = kwargs['options']
+        self.conf = kwargs.get('conf')
+        self.backup = kwargs.get('backup', False)
+        self.backup_generations = kwargs.get('backup_generations', 3)
+        self.backup_compress = kwargs.get('backup_compress')
+        self.metrics = kwargs.get('metrics', False)
+        self.metrics_dir = kwargs.get('metrics_dir')
+        self.metrics_interval = kwargs.get('metrics_interval', 30)
+        self.retries = kwargs.get('retries', 0)
+        self.retry_backoff = kwargs.get('retry_backoff', 60)
+        self.autotune = kwargs.get('autotune', False)
+        self.autotune_steps = kwargs.get('autotune_steps', 500)
+        self.autotune_ppn = kwargs.get('autotune_ppn', False)
+        self.launch_args = None
+        self.chain_segment = kwargs.get('chain_segment')
+        self.trim_dcd = kwargs.get('trim_dcd', False)
+        self.energy_series = kwargs.get('energy_series', False)
+        self.io_advisor = kwargs.get('io_advisor')
+        self.io_mtbf = kwargs.get('io_mtbf', 24)
+        self.io_budget = kwargs.get('io_budget', 0.02)
+        self.io_advice = None
+        self.recover_dcd = kwargs.get('recover_dcd', False)
+        self.recovered = None
+        self.dcd_file = None
+        self.watchdog = kwargs.get('watchdog', False)
+        self.watchdog_jump = kwargs.get('watchdog_jump', 0.1)
+        self.watchdog_temp = kwargs.get('watchdog_temp')
+        self.watchdog_pressure = kwargs.get('watchdog_pressure')
+        self.watchdog_timestep = kwargs.get('watchdog_timestep', 0.5)
+        self.watchdog_options = kwargs.get('watchdog_options') or []
+        self.watchdog_max = kwargs.get('watchdog_max', 3)
+        self.interventions = 0
+        self.divergence = None
+        self.log_capture = kwargs.get('log_capture')
+        self.log_rotate = kwargs.get('log_rotate', 1024)
+        self.scratch = kwargs.get('scratch')
+        self.sync_interval = kwargs.get('sync_interval', 300)
+        self.target_step = None
+        self.scheduler = kwargs.get('scheduler', 'local')
+        self.walltime = kwargs.get('walltime')
+        self.queue = kwargs.get('queue')
+        self.scheduler_options = kwargs.get('scheduler_options') or []
+        self.namd = kwargs.get('namd', True)
+        self.namd_exe = kwargs.get('namd_exe', 'namd')
+        self.options = kwargs.get('options') or []
         self.previous = os.path.abspath(kwargs['previous']) + '/'
         self.restart = os.path.abspath(kwargs['restart']) + '/'
-        self.run = kwargs['run']
-        self.cores = kwargs['threads']
-        self.file_name = kwargs['file_name']
+        self.run = kwargs.get('run')
+        self.cores = kwargs.get('threads', 1)
+        self.file_name = kwargs.get('file_name')
+        self.stage_policy = kwargs.get('stage')
+        self.stage = None
+        self.timer = PhaseTimer(kwargs.get('timing'), self.previous)
+        self.cache = kwargs.get('cache')
+        # Only execute() keeps the restart file index on the output folder
+        self.index_folder = None
+
+        # Pauses let a user follow the log, only the command line enables them
+        self.pacing = kwargs.get('pacing', False) and not kwargs.get('pipeline', False)
 
         self.conf_file = None
+        self.restart_files = None
+        self.restart_step = None
+        self.run_steps = None
+        self.result = RestartResult()
+        self.success = False
+
+    def pause(self, seconds=1):
+        """Pause so the user can follow the log, unless running as a pipeline"""
+
+        if self.pacing:
+            sleep(seconds)
+
+    def execute(self):
+        """Run the whole restart, return success"""
 
+        self.index_folder = self.restart
         try:
-            self.main()
+            self.success = self.main()
         except KeyboardInterrupt:
             log('error', 'Interrupted by user.')
+        return self.success
 
     def main(self):
         """Main routine"""
 
-        # Gets conf file
-        self.conf = self.search_conf()
-        if not self.conf:
+        if not self.prepare().success:
             return False
-        sleep(1)
 
-        # Prepares restart files
-        restart_files = search_previous(self.previous)
-        if not restart_files:
-            return False
-        sleep(1)
-        self.file_name = self.get_file_name(restart_files)
+        # Run remaining steps in segments when chaining
+        if self.chain_segment:
+            self.make_output()
+            return RestartChain(self, self.restart_step, self.restart_files, self.chain_segment).run()
+
+        self.write()
+
+        # Run namd when enabled
+        if self.namd:
+            return self.launch()
+
+        log('info', 'Done.')
+        return True
+
+    def prepare(self):
+        """Find restart files and edit conf file in memory, return RestartResult"""
+
+        # Indexes restart files once and chooses the stage to restart
+        with self.timer.phase('search_stage'):
+            restart_index = index_restart(self.previous, self.index_folder, self.cache.folders if self.cache else None)
+            self.stage = self.select_stage(restart_index)
+        if self.stage is False:
+            return self.result
+        self.pause()
+
+        # Gets conf file
+        with self.timer.phase('search_conf'):
+            self.conf = self.search_conf()
+        if not self.conf:
+            return self.result
+        self.pause()
 
         # Loads conf file in memory for editing
-        self.conf_file = self.read_conf()
+        with self.timer.phase('read_conf'):
+            self.conf_file = self.read_conf()
         if not self.conf_file:
-            return False
-        sleep(1)
+            return self.result
+        self.pause()
+
+        # Edits below point outputname at the restart, keep the previous trajectory
+        self.dcd_file = self.trajectory_path()
+
+        # Prepares restart files, from the trajectory when no set is usable
+        with self.timer.phase('search_previous'):
+            if self.stage:
+                self.restart_files = resolve_restart(stage_files(restart_index, self.previous, self.stage), False,
+                                                     self.structure_atoms(), not self.recover_dcd)
+        if not self.restart_files and self.recover_dcd:
+            with self.timer.phase('recover_dcd'):
+                self.restart_files = self.recover_frame()
+        if not self.restart_files:
+            return self.result
+        self.pause()
+        self.file_name = self.get_file_name(self.restart_files)
 
         # Gets last step
-        restart_step = get_restart_step(restart_files)
-        if not restart_step:
-            return False
-        sleep(1)
+        with self.timer.phase('restart_step'):
+            if self.recovered:
+                self.restart_step = str(self.recovered['step'])
+            else:
+                self.restart_step = get_restart_step(self.restart_files)
+        if not self.restart_step:
+            return self.result
+        self.pause()
+
+        # Make basic edits on conf file
+        with self.timer.phase('configure_restart'):
+            if not self.configure_restart(self.restart_step, self.restart_files):
+                return self.result
+
+            # Edit optional arguments on conf file
+            self.configure_optional()
+        self.pause()
+
+        self.result.restart_files = self.restart_files
+        self.result.restart_step = int(self.restart_step)
+        self.result.run_steps = int(self.run_steps)
+        self.result.conf_text = ''.join(self.conf_file)
+        self.result.conf_path = self.restart + self.file_name + '.conf'
+        self.result.success = True
+        return self.result
+
+    def make_output(self):
+        """Create output folder and trim previous trajectory"""
 
         # Analyze restart folder
         self.prepare_restart()
-        sleep(1)
+        self.pause()
 
-        # Make basic edits on conf file
-        self.configure_restart(restart_step, restart_files)
-        sleep(1)
+        # Write restart files recovered from the trajectory
+        if self.recovered:
+            write_frame_restart(self.recovered['dcd'], self.recovered['frame'], self.restart_files['coor'],
+                                self.restart_files['xsc'], self.recovered['step'], self.recovered['origin'])
 
-        # Edit optional arguments on conf file
-        self.configure_optional()
-        self.save_conf()
-        sleep(1)
+        # Drop trajectory frames the restart will write again
+        if self.trim_dcd:
+            self.trim_trajectory(self.restart_step)
 
-        # Run namd when enabled
-        if self.namd:
-            self.run_namd()
-        else:
-            log('info', 'Done.')
+    def write(self):
+        """Write prepared conf file to output folder, return its path"""
+
+        self.make_output()
+        with self.timer.phase('save_conf'):
+            self.save_conf()
+        self.pause()
+        return self.result.conf_path
+
+    def launch(self):
+        """Run or submit namd on the written conf file"""
+
+        with self.timer.phase('namd'):
+            if self.scheduler != 'local':
+                return self.submit_namd()
+            success = self.supervise_namd(self.restart_step)
+
+        if self.energy_series:
+            self.extract_energy()
+        return success
 
     def search_conf(self):
         """Search conf files archive"""
@@ -107,26 +286,79 @@ class DynamicRestart:
                 return False
 
         log('info', 'Searching conf file.')
-        cmd = 'find ' + self.previous + ' -name "*conf"'
-        output = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
-        output = output.stdout.readlines()
+        if self.cache:
+            output = self.cache.find(self.previous, 'conf')
+        else:
+            cmd = 'find ' + self.previous + ' -name "*conf"'
+            output = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
+            output = [line.decode('utf-8').strip() for line in output.stdout.readlines()]
+        if len(output) > 1:
+            output = self.match_conf(output)
         if len(output) != 1:
             log('error', 'Conf file not found! Please specify path with -c.')
             return False
         else:
-            return output[0].decode('utf-8').strip()
+            return output[0]
+
+    def match_conf(self, paths):
+        """Keep conf files named after the chosen stage or writing it"""
+
+        prefix = os.path.basename(self.stage)
+        matches = [path for path in paths if os.path.basename(path) == prefix + '.conf']
+        if not matches:
+            for path in paths:
+                output = NamdConf.read(path).value('outputname')
+                if output and os.path.basename(output) == prefix:
+                    matches.append(path)
+
+        # Replicas may share conf names, prefer the one next to the restart files
+        folder = os.path.normpath(os.path.join(self.previous, os.path.dirname(self.stage)))
+        return [path for path in matches if os.path.dirname(os.path.abspath(path)) == folder] or matches
+
+    def select_stage(self, files):
+        """Choose the restart prefix by name or policy when input holds many"""
+
+        log('info', 'Searching restart files.')
+        stages = restart_stages(files, self.previous)
+        if not stages and self.recover_dcd:
+            log('warning', 'Restart files not found.')
+            return ''
+        if not stages:
+            log('critical', 'Restart files not found. Aborting!')
+            return False
+
+        stage = pick_stage(stages, self.stage_policy)
+        if stage is None:
+            log('critical', 'Stage ' + self.stage_policy + ' not found or ambiguous. Found ' +
+                ', '.join(other['name'] for other in stages) + '. Aborting!')
+            return False
+
+        if len(stages) > 1:
+            log('info', 'Found stages ' + ', '.join(other['name'] + ' (step ' + str(other['step']) + ')'
+                                                  for other in stages) + '.')
+            log('info', 'Using stage ' + stage['name'] + '.')
+        return stage['name']
 
     def read_conf(self):
-        """Read conf file to list"""
+        """Read conf file to indexed model"""
 
-        with open(self.conf) as conf:
-            conf_file = conf.readlines()
+        conf_file = self.cache.conf(self.conf) if self.cache else NamdConf.read(self.conf)
 
-            if len(conf_file) == 0:
-                log('error', 'Could not open .conf file.')
-                return False
+        if len(conf_file.lines) == 0:
+            log('error', 'Could not open .conf file.')
+            return False
+
+        return conf_file
 
-            return conf_file
+    def structure_atoms(self):
+        """Get number of atoms from the conf structure file when available"""
+
+        structure = self.conf_file.value('structure')
+        if not structure:
+            return None
+        if not os.path.isabs(structure):
+            structure = os.path.join(os.path.dirname(self.conf), structure)
+        return psf_atoms(structure)
 
     def get_file_name(self, files):
         """Gets file name if not passed"""
@@ -142,9 +374,104 @@ class DynamicRestart:
         if not os.path.exists(self.restart):
             os.makedirs(self.restart)
         else:
-            if len(os.listdir(self.restart)) != 0:
+            # The restart file index cache is written here before this check
+            if [name for name in os.listdir(self.restart) if name != INDEX_FILE]:
                 log('warning', 'Output folder not empty. Subscribing.')
-                sleep(1)
+                self.pause()
+
+    def trajectory_path(self):
+        """Get previous dcd file from dcdfile or outputname on conf file"""
+
+        dcd_file = self.conf_file.value('dcdfile')
+        if not dcd_file:
+            output = self.conf_file.value('outputname')
+            dcd_file = output + '.dcd' if output else None
+        if dcd_file and not os.path.isabs(dcd_file):
+            dcd_file = os.path.join(os.path.dirname(self.conf), dcd_file)
+        return dcd_file
+
+    def trim_trajectory(self, restart_step):
+        """Cut previous dcd at the restart step frame"""
+
+        dcd_file = self.dcd_file
+        if not dcd_file:
+            log('warning', 'Could not find dcd file on .conf file. Skipping trim.')
+            return False
+        if not os.path.exists(dcd_file):
+            log('warning', 'Dcd file ' + dcd_file + ' not found. Skipping trim.')
+            return False
+
+        try:
+            dcd = DcdFile(dcd_file)
+        except (OSError, ValueError) as error:
+            log('warning', 'Could not read dcd file: ' + str(error) + '. Skipping trim.')
+            return False
+
+        dcd_freq = self.conf_file.value('dcdfreq')
+        if dcd_freq and dcd_freq.isdigit() and int(dcd_freq) != dcd.nsavc:
+            log('warning', 'Dcd saves every ' + str(dcd.nsavc) + ' steps but .conf file dcdfreq is ' +
+                dcd_freq + '. Trusting dcd header.')
+
+        trim_dcd(dcd_file, int(restart_step))
+        return True
+
+    def recover_frame(self):
+        """Plan restart files from the last complete frame of the previous dcd"""
+
+        dcd_file = self.dcd_file
+        if not dcd_file or not os.path.exists(dcd_file):
+            log('critical', 'No dcd file to recover from. Aborting!')
+            return False
+
+        try:
+            dcd = DcdFile(dcd_file)
+            index = last_frame(dcd)
+        except (OSError, ValueError) as error:
+            log('critical', 'Could not read dcd file: ' + str(error) + '. Aborting!')
+            return False
+        if index is None:
+            log('critical', 'No complete frame on ' + dcd_file + '. Aborting!')
+            return False
+
+        atoms = self.structure_atoms()
+        if atoms is not None and atoms != dcd.natoms:
+            log('critical', 'Dcd has ' + str(dcd.natoms) + ' atoms but structure has ' + str(atoms) + '. Aborting!')
+            return False
+
+        dcd_freq = self.conf_file.value('dcdfreq')
+        if dcd_freq and dcd_freq.isdigit() and int(dcd_freq) != dcd.nsavc:
+            log('warning', 'Dcd saves every ' + str(dcd.nsavc) + ' steps but .conf file dcdfreq is ' +
+                dcd_freq + '. Trusting dcd header.')
+
+        origin = self.search_option('cellorigin')
+        origin = self.conf_file.substitute(origin.values()[0]).split()[:3] \
+            if origin is not None and not origin.commented and origin.values() else (0.0, 0.0, 0.0)
+
+        step = dcd.frame_step(index)
+        if not self.file_name:
+            self.file_name = os.path.basename(self.stage) or os.path.basename(dcd_file)[:-len('.dcd')]
+        self.recovered = {'dcd': dcd, 'frame': index, 'step': step, 'origin': origin}
+
+        log('warning', 'Recovering from frame ' + str(index + 1) + ' of ' + str(dcd.frames) + ' of ' +
+            os.path.basename(dcd_file) + ' (step ' + str(step) + '). Velocities will be reinitialized.')
+        self.pause()
+        return {'coor': self.restart + self.file_name + '.recovered.coor',
+                'xsc': self.restart + self.file_name + '.recovered.xsc'}
+
+    def conf_temperature(self):
+        """Get temperature for new velocities, also from commented lines"""
+
+        for option in ('temperature', 'reinitvels', 'langevintemp'):
+            line = self.search_option(option)
+            if line is None or not line.values():
+                continue
+            value = self.conf_file.substitute(line.values()[0].split()[0])
+            try:
+                float(value)
+            except ValueError:
+                continue
+            return value
+        return None
 
     def configure_restart(self, restart_step, restart_files):
         """Make basic edits on conf file"""
@@ -152,85 +479,104 @@ class DynamicRestart:
         log('info', 'Preparing .conf file.')
 
         restart_insert = ['set outputname ' + self.restart + self.file_name,
-                          'bincoordinates ' + restart_files['coor'],
-                          'binvelocities ' + restart_files['vel'],
-                          'extendedSystem ' + restart_files['xsc'],
-                          'firsttimestep ' + restart_step]
+                          'bincoordinates ' + restart_files['coor']]
+        if 'vel' in restart_files:
+            restart_insert.append('binvelocities ' + restart_files['vel'])
+        restart_insert += ['extendedSystem ' + restart_files['xsc'],
+                           'firsttimestep ' + restart_step]
         restart_comment = ['temperature', 'minimize', 'reinitvels']
 
-        coord_index = self.search_option('coordinates') + 1
-        self.conf_file.insert(coord_index, '\n')
+        # Recovered frames have no velocities, draw them at the conf temperature
+        if 'vel' not in restart_files:
+            temperature = self.conf_temperature()
+            if temperature is None:
+                log('error', 'Could not find temperature on .conf file. Please add it with -a temperature <K>.')
+                return False
+            restart_insert.append('temperature ' + temperature)
+            restart_comment = ['minimize']
+            line = self.search_option('binvelocities')
+            if line is not None and not line.commented:
+                restart_comment.append('binvelocities')
 
-        self.edit_run_steps(restart_step)
+        anchor = self.conf_file.insert('', self.search_option('coordinates'))
+
+        if not self.edit_run_steps(restart_step):
+            return False
 
         for option in restart_insert:
-            self.update_conf(option, coord_index)
+            self.update_conf(option, anchor)
 
         for option in restart_comment:
             self.comment_conf(option)
 
+        # Recovered frames are only written with the output folder
+        if self.io_advisor and 'vel' in restart_files:
+            self.advise_io(restart_files)
+
+        return True
+
+    def advise_io(self, restart_files):
+        """Report or apply restart and trajectory frequencies suited to output storage"""
+
+        # Measure once, chain segments and relaunches reuse the advice
+        if self.io_advice is None:
+            self.io_advice = advise_io(self.conf_file, restart_files, self.restart, self.previous,
+                                       self.io_mtbf, self.io_budget)
+
+        if self.io_advisor == 'apply':
+            for option, frequency in self.io_advice.items():
+                log('info', 'Setting ' + option + ' to ' + str(frequency) + '.')
+                self.update_conf(option + ' ' + str(frequency))
+
     def search_option(self, option):
-        """Search an option index on conf file"""
+        """Search an option line on conf file"""
 
-        for line in self.conf_file:
-            if line.startswith(option) or line.startswith('#' + option):
-                return self.conf_file.index(line)
-        return False
+        return self.conf_file.find(option)
 
-    def update_conf(self, option, base_index=0):
+    def update_conf(self, option, after=None):
         """Edit conf file to include/uncomment option"""
 
-        base_index = base_index + 1
-        if base_index == 1:
-            base_index = len(self.conf_file) - 1
-
         option = format_option(option)
-
-        option_index = self.search_option(option[0])
-        if option_index:
-            self.conf_file[option_index] = ' '.join(option) + '\n'
-        else:
-            self.conf_file.insert(base_index, ' '.join(option) + '\n')
+        self.conf_file.set(' '.join(option), after)
 
     def comment_conf(self, option):
         """Edit conf file to comment option"""
 
         option = format_option(option)
 
-        option_index = self.search_option(option[0])
-        if option_index:
-            if not self.conf_file[option_index].startswith('#'):
-                self.conf_file[option_index] = '#' + self.conf_file[option_index]
-        else:
+        if not self.conf_file.comment(option[0]):
             log('warning', 'Option "' + ' '.join(option) + '" not found. Ignoring.')
-            sleep(1)
+            self.pause()
 
     def edit_run_steps(self, restart_step):
         """Edit the number of run steps"""
 
-        if self.run:
-            log('info', 'Setting run steps to ' + self.run + '.')
-            self.update_conf('run ' + self.run)
+        if self.target_step is not None:
+            steps = str(self.target_step - int(restart_step))
+        elif self.run:
+            steps = self.run
         else:
             steps = self.get_remaining_steps(restart_step)
+            if not steps:
+                log('error', 'Could not read run steps from .conf file. Please specify with -r.')
+                return False
 
-            log('info', 'Setting run steps to ' + steps + '.')
-            self.update_conf('run ' + steps)
+        log('info', 'Setting run steps to ' + steps + '.')
+        self.update_conf('run ' + steps)
+        self.run_steps = steps
+
+        return True
 
     def get_remaining_steps(self, restart_step):
         """Get number of remaining steps to complete dynamic"""
 
-        previous_line = self.conf_file[self.search_option('run')]
-        previous_step = previous_line.strip().split()[1]
-
-        firsttime_line_index = self.search_option('firsttimestep')
-        if firsttime_line_index:
-            firsttime_line = self.conf_file[firsttime_line_index]
-            first_step = firsttime_line.strip().split()[1]
-        else:
-            first_step = 0
+        try:
+            previous_step = int(self.conf_file.value('run'))
+            first_step = int(self.conf_file.value('firsttimestep', 0))
+        except (TypeError, ValueError):
+            return False
 
-        next_time_step = int(previous_step) - (int(restart_step) - int(first_step))
+        next_time_step = previous_step - (int(restart_step) - first_step)
         next_time_step = next_time_step if next_time_step != 0 else restart_step
 
         return str(next_time_step)
@@ -246,55 +592,238 @@ class DynamicRestart:
         """Save conf file"""
 
         log('info', 'Saving .conf file at ' + self.restart)
-        conf = self.restart + self.file_name + '.conf'
-        with open(conf, 'w') as file:
-            for line in self.conf_file:
-                file.write(line)
+        self.conf_file.save(self.restart + self.file_name + '.conf')
+
+    def submit_namd(self):
+        """Submit namd run to a cluster scheduler"""
+
+        backend = get_backend(self.scheduler, self.restart, self.walltime, self.queue,
+                              self.scheduler_options, None)
+        job = make_job(self.namd_exe, self.restart + self.file_name, self.cores, self.launch_args)
+        return bool(backend.submit([job]))
+
+    def supervise_namd(self, restart_step, restart_files=None):
+        """Run namd relaunching from the newest restart files while it fails or diverges"""
+
+        attempt = 0
+        backoff = self.retry_backoff
+        restart_files = restart_files or self.restart_files
+
+        while not self.run_namd(attempt + self.interventions):
+            if self.divergence:
+                if self.interventions >= self.watchdog_max:
+                    log('error', 'Dynamic still diverging after ' + str(self.interventions) + ' interventions.')
+                    return False
+                restart_step, restart_files = self.intervene(restart_step, restart_files)
+                if not restart_step:
+                    return False
+                continue
+
+            if attempt >= self.retries:
+                if self.retries:
+                    log('error', 'Dynamic failed after ' + str(attempt + 1) + ' attempts.')
+                return False
+
+            new_files = search_previous(self.restart, silent=True, cache_folder=self.restart,
+                                        atoms=self.structure_atoms(), stage=self.file_name)
+            new_step = get_restart_step(new_files) if new_files else False
+            if not new_step or int(new_step) <= int(restart_step):
+                log('error', 'No progress since last attempt. Not relaunching.')
+                return False
+
+            attempt += 1
+            log('warning', 'Relaunching from step ' + new_step + ' in ' + str(backoff) + 's '
+                '(attempt ' + str(attempt) + ' of ' + str(self.retries) + ').')
+            sleep(backoff)
+            backoff *= 2
+
+            if not self.relaunch(new_step, new_files):
+                return False
+            restart_step, restart_files = new_step, new_files
+
+        return True
+
+    def relaunch(self, restart_step, restart_files):
+        """Regenerate conf from the original one with new restart files"""
+
+        self.conf_file = self.read_conf()
+        if not self.conf_file or not self.configure_restart(restart_step, restart_files):
+            return False
+        self.configure_optional()
+        self.configure_safety()
+        self.save_conf()
+        return True
+
+    def configure_safety(self):
+        """Reduce timestep and add watchdog options once a run diverged"""
+
+        if not self.interventions:
+            return
+
+        timestep = float(self.conf_file.value('timestep', 1)) * self.watchdog_timestep ** self.interventions
+        log('info', 'Setting timestep to ' + format(timestep, 'g') + '.')
+        self.update_conf('timestep ' + format(timestep, 'g'))
 
-    def run_namd(self):
+        for item in self.watchdog_options:
+            log('info', 'Setting parameter "' + ' '.join(item) + '".')
+            self.update_conf(' '.join(item))
+
+    def intervene(self, restart_step, restart_files):
+        """Relaunch a diverged run from the last restart set before divergence with safer settings"""
+
+        divergence, self.divergence = self.divergence, None
+
+        # Restart sets written by the run before it diverged, else the set it started from
+        found = search_previous(self.restart, silent=True, cache_folder=self.restart, atoms=self.structure_atoms(),
+                                stage=self.file_name, before=divergence['step'])
+        if found:
+            restart_files, restart_step = found, get_restart_step(found)
+
+        previous_timestep = self.conf_file.value('timestep', '1')
+        self.interventions += 1
+        if not self.relaunch(restart_step, restart_files):
+            return None, None
+
+        log('warning', 'Relaunching from step ' + restart_step + ' (intervention ' + str(self.interventions) +
+            ' of ' + str(self.watchdog_max) + ').')
+        divergence.update(intervention=self.interventions, restart_step=int(restart_step),
+                          restart_files=restart_files,
+                          timestep={'from': previous_timestep, 'to': self.conf_file.value('timestep')},
+                          options=[' '.join(item) for item in self.watchdog_options])
+        record_intervention(self.restart + self.file_name + '.watchdog.json', divergence)
+        return restart_step, restart_files
+
+    def extract_energy(self):
+        """Update energy columns with the logs of previous and restart runs"""
+
+        series = EnergySeries(self.restart + self.file_name + '.energy')
+        series.update(find_logs([self.previous, self.restart]))
+
+    def tune_launch(self):
+        """Get best launch arguments benchmarking short namd runs"""
+
+        atoms = self.structure_atoms()
+        if atoms is None:
+            header = read_header(self.conf_file.value('bincoordinates'))
+            atoms = header[0] if header else None
+        if atoms is None:
+            log('warning', 'Could not get number of atoms. Skipping autotune.')
+            return None
+
+        max_cores = self.cores if self.cores > 1 else os.cpu_count()
+        return autotune(self.namd_exe, self.restart + self.file_name + '.conf', atoms, max_cores,
+                        self.autotune_steps, self.autotune_ppn)
+
+    def run_namd(self, attempt=0):
         """Runs namd executable with # cores"""
 
-        log('info', 'Running namd with ' + str(self.cores) + ' cores.')
+        if self.autotune and self.launch_args is None:
+            self.launch_args = self.tune_launch() or []
+
+        if self.launch_args:
+            log('info', 'Running namd with "' + ' '.join(self.launch_args) + '".')
+        else:
+            log('info', 'Running namd with ' + str(self.cores) + ' cores.')
 
+        suffix = '.retry' + str(attempt) if attempt else ''
         conf_file = self.restart + self.file_name + '.conf'
-        log_file = self.restart + self.file_name + '.log'
-        err_file = self.restart + self.file_name + '.err'
+        log_file = self.restart + self.file_name + suffix + '.log'
+        err_file = self.restart + self.file_name + suffix + '.err'
 
-        cmd = [self.namd_exe, conf_file]
+        stage = None
+        if self.scratch:
+            stage = Stage(conf_file, self.scratch, os.path.dirname(self.conf), self.file_name, self.sync_interval)
+            try:
+                conf_file = stage.prepare()
+            except OSError as error:
+                log('error', 'Could not stage inputs on ' + self.scratch + ': ' + str(error))
+                return False
 
-        if self.cores != 1:
-            cmd.insert(1, '+p' + str(self.cores))
+        cmd = namd_command(self.namd_exe, conf_file, self.cores, args=self.launch_args)
 
-        try:
-            with open(log_file, 'w') as out, open(err_file, "w") as err:
-                process = subprocess.Popen(cmd, stdout=out, stderr=err)
+        capture = None
+        if self.log_capture:
+            capture = PipeCapture(log_file, err_file, self.log_capture, self.log_rotate)
 
-                while process.poll() is None:
-                    if self.backup:
-                        self.backup_restart()
-                    sleep(300)
+        monitor = None
+        if self.metrics:
+            monitor = LogMonitor.from_conf(self.conf_file, None if capture else log_file,
+                                           self.restart + self.file_name, self.metrics_dir, self.metrics_interval)
+            if capture:
+                capture.listeners.append(monitor.parser.feed)
 
-                else:
-                    finish_dynamic(err_file)
+        watchdog = None
+        if self.watchdog:
+            watchdog = DivergenceWatchdog(self.watchdog_jump, self.watchdog_temp, self.watchdog_pressure)
+            if capture:
+                capture.listeners.append(watchdog.feed)
 
+        try:
+            if capture:
+                process = subprocess.Popen(cmd, stdout=capture.out_write, stderr=capture.err_write)
+                capture.start()
+            else:
+                with open(log_file, 'w') as out, open(err_file, "w") as err:
+                    process = subprocess.Popen(cmd, stdout=out, stderr=err)
         except (PermissionError, FileNotFoundError):
+            if capture:
+                capture.finish()
             log('error', 'Namd exe not found! Please specify path with -e.')
+            return False
 
-    def backup_restart(self):
-        """Checks to create backups file for restarting"""
-
-        restart_files = search_previous(self.restart, silent=True)
-        if not restart_files or restart_files['xsc'].endswith('bak'):
-            return
-
-        for file in restart_files:
-            try:
-                write_backup(restart_files[file])
-            except FileNotFoundError:
-                break
+        if monitor:
+            monitor.start()
+
+        if watchdog:
+            if not capture:
+                watchdog.start(log_file)
+            watchdog.attach(process)
+
+        watcher = None
+        if self.backup:
+            store = BackupStore(self.restart, self.file_name, self.backup_generations, self.backup_compress)
+            watcher = RestartWatcher(self.restart + self.file_name, store.backup)
+            watcher.start()
+
+        previous_handler = None
+        if stage:
+            stage.start()
+            previous_handler = forward_sigterm(process)
+
+        process.wait()
+        err_message = capture.finish() if capture else None
+        if watchdog:
+            watchdog.stop()
+            self.divergence = watchdog.triggered
+        if stage:
+            stage.finish()
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+        if watcher:
+            watcher.stop()
+        if monitor:
+            monitor.stop()
+
+        stopped = None
+        if self.divergence:
+            stopped = 'diverged at step ' + str(self.divergence['step']) + ' (' + self.divergence['rule'] + ')'
+        return finish_dynamic(err_file, err_message, process.returncode, stopped)
 
 
 if __name__ == '__main__':
     parser = make_parser()
     args = parser.parse_args()
-    DynamicRestart(**vars(args))
+    setup_logging(logging.DEBUG if args.verbose else logging.INFO)
+    if args.daemon:
+        RestartDaemon(args.daemon, vars(args)).serve()
+    elif not args.previous or not args.restart:
+        parser.error('the following arguments are required: -i/--input, -o/--output')
+    elif (args.batch or args.all_stages) and args.chain_segment:
+        parser.error('argument -S/--chain-segment: not allowed with -b/--batch or --all-stages')
+    elif args.namd and args.scheduler != 'local' and unsupervised_options(args):
+        parser.error('argument --scheduler: ' + ', '.join(unsupervised_options(args)) + ' not allowed with ' +
+                     args.scheduler + ' jobs')
+    elif args.batch or args.all_stages:
+        run_batch(args)
+    else:
+        DynamicRestart(pacing=True, **vars(args)).execute()
@@ -30,27 +30,40 @@ def format_option(option):
     return option
 
 
-def write_backup(file):
-    """Write the backups on file"""
+def namd_command(namd_exe, conf_file, cores, pemap=None, args=None):
+    """Build namd command line with # cores and optional core pinning"""
 
-    import shutil
+    if args:
+        return [namd_exe, *args, conf_file]
 
-    if file.endswith('old'):
-        new_file = file.replace('old', 'bak')
-    else:
-        new_file = file + '.bak'
+    cmd = [namd_exe, conf_file]
+
+    if cores != 1:
+        cmd.insert(1, '+p' + str(cores))
 
-    shutil.copy(file, new_file)
+    if pemap is not None:
+        cmd[1:1] = ['+setcpuaffinity', '+pemap', pemap]
 
+    return cmd
 
-def finish_dynamic(err):
-    """Check for errors on dynamic end"""
 
-    with open(err, 'r') as err_file:
-        err_message = err_file.read()
+def finish_dynamic(err, err_message=None, returncode=0, stopped=None):
+    """Check how the dynamic ended, stopped being the reason the restarter ended namd"""
 
-        if len(err_message) > 1:
-            log('error', 'Dynamic ended with error status:')
-            print(err_message)
-        else:
-            log('info', 'Dynamic finished.')
+    if err_message is None:
+        with open(err, 'r') as err_file:
+            err_message = err_file.read()
+
+    if len(err_message) > 1:
+        log('error', 'Dynamic ended with error status:')
+        print(err_message)
+        return False
+    elif stopped:
+        log('warning', 'Dynamic stopped: ' + stopped + '.')
+        return False
+    elif returncode != 0:
+        log('error', 'Dynamic exited with code ' + str(returncode) + '.')
+        return False
+    else:
+        log('info', 'Dynamic finished.')
+        return True
@@ -19,107 +19,270 @@
 """
 
 from color_log import log
-import subprocess
-from time import sleep
-
-
-def search_previous(path, silent=False):
-    """Search restart files on previous folder"""
+from restart_validator import validate_sets
+from restart_watcher import read_xsc_step, written_together
+from backup_store import BACKUP_FOLDER
+import json
+import re
+import os
+
+
+INDEX_FILE = '.namd_restarter_index.json'
+RESTART_NAME = re.compile(r'^(?P<prefix>.+)\.restart\.(?P<kind>xsc|coor|vel)(?:\.(?P<tag>old|bak|\d+))?$')
+GENERATIONS = {'': ('current', 0), 'old': ('old', 1), 'bak': ('backup', 2)}
+ROTATION = {'': 'old', 'old': ''}
+
+
+def scan_folder(path, cached=None):
+    """Index files on folder tree reusing cached entries of unchanged folders"""
+
+    cached = cached or dict()
+    index = dict()
+    folders = [os.path.abspath(path)]
+
+    while folders:
+        folder = folders.pop()
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            continue
+
+        entry = cached.get(folder)
+        if entry is None or entry['mtime'] != mtime:
+            entry = {'mtime': mtime, 'files': dict(), 'folders': list()}
+            try:
+                with os.scandir(folder) as items:
+                    for item in items:
+                        if item.is_dir(follow_symlinks=False):
+                            entry['folders'].append(item.path)
+                        elif item.is_file():
+                            stat = item.stat()
+                            entry['files'][item.name] = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                continue
+
+        index[folder] = entry
+        folders.extend(entry['folders'])
+
+    return index
+
+
+def load_index(cache_folder, path):
+    """Load cached index for path from cache folder"""
+
+    try:
+        with open(os.path.join(cache_folder, INDEX_FILE)) as cache:
+            return json.load(cache).get(os.path.abspath(path))
+    except (OSError, ValueError):
+        return None
+
+
+def save_index(cache_folder, path, index):
+    """Save index for path on cache folder"""
+
+    cache_file = os.path.join(cache_folder, INDEX_FILE)
+    try:
+        with open(cache_file) as cache:
+            indexes = json.load(cache)
+    except (OSError, ValueError):
+        indexes = dict()
+
+    # Rewrite in place so the cache folder mtime is not touched
+    indexes[os.path.abspath(path)] = index
+    try:
+        with open(cache_file, 'w') as cache:
+            json.dump(indexes, cache)
+    except OSError:
+        pass
+
+
+def index_restart(path, cache_folder=None, folders=None):
+    """Get restart files on path as {file: (size, mtime)}, with folders an in memory index cache"""
+
+    if folders is not None or (cache_folder and not os.path.isdir(cache_folder)):
+        cache_folder = None
+
+    cached = folders.get(os.path.abspath(path)) if folders is not None else None
+    if cache_folder:
+        cached = load_index(cache_folder, path)
+        if not os.path.exists(os.path.join(cache_folder, INDEX_FILE)):
+            open(os.path.join(cache_folder, INDEX_FILE), 'w').close()
+
+    index = scan_folder(path, cached)
+    if cache_folder and index != cached:
+        save_index(cache_folder, path, index)
+    if folders is not None:
+        folders[os.path.abspath(path)] = index
+
+    files = dict()
+    for folder, entry in index.items():
+        for name, (size, mtime) in entry['files'].items():
+            if 'restart' in name and name != INDEX_FILE:
+                files[os.path.join(folder, name)] = (size, mtime)
+    return files
+
+
+def search_previous(path, silent=False, cache_folder=None, atoms=None, folders=None, stage=None, before=None):
+    """Search restart files on previous folder, only those of stage and older than step before when given"""
 
     if not silent:
         log('info', 'Searching restart files.')
 
-    cmd = 'find ' + path + ' -name "*restart*" -exec du -sh {} \\;'
-    output = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
+    files = index_restart(path, cache_folder, folders)
+    if stage:
+        files = stage_files(files, path, stage)
+    return resolve_restart(files, silent, atoms, before=before)
+
+
+def prefix_stage(folder, prefix, root):
+    """Get stage of a restart prefix on folder, rotated backups belong to the stage they back up"""
+
+    if os.path.basename(folder) == BACKUP_FOLDER:
+        folder = os.path.dirname(folder)
+    return os.path.relpath(os.path.join(folder, prefix), root)
+
+
+def stage_name(file_name, root):
+    """Get stage of a restart file as its prefix path relative to root, None for other files"""
+
+    match = RESTART_NAME.match(os.path.basename(file_name))
+    if not match:
+        return None
+    return prefix_stage(os.path.dirname(file_name), match.group('prefix'), root)
+
+
+def stage_files(files, root, stage):
+    """Keep restart files of one stage"""
+
+    return {file_name: stat for file_name, stat in files.items() if stage_name(file_name, root) == stage}
+
+
+def restart_stages(files, root):
+    """Get every restart prefix on files as [{name, step, mtime}] with their newest step and write"""
+
+    stages = dict()
+    for candidate in restart_sets(files):
+        name = prefix_stage(candidate['folder'], candidate['prefix'], root)
+        stage = stages.setdefault(name, {'name': name, 'step': None, 'mtime': 0})
+        stage['mtime'] = max([stage['mtime']] + [mtime / 1e9 for _, _, mtime in candidate['members'].values()])
+
+        step = read_xsc_step(candidate['files']['xsc']) if 'xsc' in candidate['files'] else None
+        if step is not None and (stage['step'] is None or step > stage['step']):
+            stage['step'] = step
+
+    return sorted(stages.values(), key=lambda stage: stage['name'])
+
+
+def pick_stage(stages, policy=None):
+    """Choose a stage by name, by newest step (latest) or by newest files (recent)"""
+
+    if policy in (None, 'latest'):
+        return max(stages, key=lambda stage: (stage['step'] if stage['step'] is not None else -1, stage['mtime']))
+    if policy == 'recent':
+        return max(stages, key=lambda stage: stage['mtime'])
+
+    policy = os.path.normpath(policy)
+    named = [stage for stage in stages if stage['name'] == policy]
+    if not named:
+        named = [stage for stage in stages if os.path.basename(stage['name']) == policy]
+    return named[0] if len(named) == 1 else None
+
 
-    return resolve_restart(output, silent)
+def restart_sets(files):
+    """Group restart files in sets of (folder, prefix, generation)"""
 
+    sets = dict()
+    for file_name, (size, mtime) in files.items():
+        match = RESTART_NAME.match(os.path.basename(file_name))
+        if not match:
+            continue
 
-def resolve_restart(files, silent):
-    """Check for size on restart files"""
+        key = (os.path.dirname(file_name), match.group('prefix'), match.group('tag') or '')
+        sets.setdefault(key, dict())[match.group('kind')] = (file_name, size, mtime)
+
+    candidates = list()
+    for (folder, prefix, tag), members in sets.items():
+        if tag.isdigit():
+            label, priority = 'backup generation ' + tag, 3
+        else:
+            label, priority = GENERATIONS[tag]
+
+        # namd renames the current set to .old before writing a new one
+        reference = sets.get((folder, prefix, ROTATION[tag])) if tag in ROTATION else None
+        candidates.append({'folder': folder, 'prefix': prefix, 'label': label, 'priority': priority, 'members': members,
+                           'files': {kind: members[kind][0] for kind in members}, 'reference': reference})
+    return candidates
+
+
+def check_set(candidate):
+    """Check set is complete and members were written together, return reason or None"""
+
+    members = candidate['members']
+    if len(members) < 3:
+        return 'missing ' + ', '.join(kind for kind in ('xsc', 'coor', 'vel') if kind not in members)
+    if any(size == 0 for _, size, _ in members.values()):
+        return 'empty files'
+
+    reference = candidate['reference']
+    if not written_together({kind: mtime / 1e9 for kind, (_, _, mtime) in members.items()},
+                            reference and {kind: mtime / 1e9 for kind, (_, _, mtime) in reference.items()}):
+        return 'files written at different times'
+
+    candidate['step'] = read_xsc_step(candidate['files']['xsc'])
+    if candidate['step'] is None:
+        return 'unreadable xsc'
+    return None
+
+
+def resolve_restart(files, silent, atoms=None, final=True, before=None):
+    """Check for complete restart sets, final when there is no other way to restart"""
 
-    files = files.stdout.readlines()
     if len(files) == 0:
         if not silent:
-            log('critical', 'Restart files not found. Aborting!')
+            log('critical' if final else 'warning', 'Restart files not found.' + (' Aborting!' if final else ''))
         return False
 
-    files_size = dict()
-    new_restart = list()
-    old_restart = list()
-    backup_restart = list()
-
-    for file in files:
-        file = file.decode('utf-8').strip().split('\t')
-
-        file_name = file[1]
-        files_size[file_name] = file[0]
-
-        if file_name.endswith(".xsc") or file_name.endswith(".coor") or file_name.endswith(".vel"):
-            new_restart.append(file_name)
-        if file_name.endswith(".old"):
-            old_restart.append(file_name)
-        if file_name.endswith(".bak"):
-            backup_restart.append(file_name)
-
-    return choose_restart(files_size, new_restart, old_restart, backup_restart, silent)
-
-
-def choose_restart(files_dic, new, old, back, silent):
-    """Choose restart files not empty"""
-
-    if len(new) >= 3:
-        for file in new:
-            if files_dic[file] == '0':
-                break
-            else:
-                return annotate_restart(new, silent)
-
-    if len(old) >= 3:
-        for file in old:
-            if files_dic[file] == '0':
-                break
-            else:
-                if not silent:
-                    log('warning', 'Restart files empty or missing, using old restart files.')
-                sleep(1)
-                return annotate_restart(old, silent)
-
-    if len(back) >= 3:
-        for file in back:
-            if files_dic[file] == '0':
-                break
-            else:
-                if not silent:
-                    log('warning', 'Restart files empty or missing, using backup restart files.')
-                sleep(1)
-                return annotate_restart(back, silent)
-
-    if not silent:
-        log('critical', 'Restart files empty or missing. Aborting!')
-    return False
+    return choose_restart(restart_sets(files), silent, atoms, final, before)
 
 
-def annotate_restart(file_list, silent):
-    """Create dict with restart files"""
+def choose_restart(candidates, silent, atoms=None, final=True, before=None):
+    """Choose the newest complete and valid restart set"""
 
-    annotated_files = dict()
-    for file in file_list:
-        if '.restart.xsc' in file:
-            annotated_files['xsc'] = file
-        elif '.restart.coor' in file:
-            annotated_files['coor'] = file
-        elif '.restart.vel' in file:
-            annotated_files['vel'] = file
+    rejected = list()
+    complete = list()
+    for candidate in candidates:
+        reason = check_set(candidate)
+        if not reason and before is not None and candidate['step'] >= before:
+            reason = 'written at or after step ' + str(before)
+        if reason:
+            rejected.append((candidate, reason))
         else:
-            if not silent:
-                log('error', 'Missing restart file.')
-            return False
+            complete.append(candidate)
 
-    if not silent:
-        log('info', 'Restart files ready.')
+    # Newest step first, then current, old, backup and rotated generations
+    complete.sort(key=lambda candidate: (-candidate['step'], candidate['priority']))
+    results = validate_sets([candidate['files'] for candidate in complete], atoms)
 
-    return annotated_files
+    for candidate, (valid, reason) in zip(complete, results):
+        if not valid:
+            rejected.append((candidate, reason))
+            continue
+
+        if not silent:
+            for other, reason in rejected:
+                if other.get('step') is None or other['step'] >= candidate['step']:
+                    log('warning', 'Skipping ' + other['label'] + ' restart files of ' + other['prefix'] +
+                        ': ' + reason + '.')
+            if candidate['priority']:
+                log('warning', 'Using ' + candidate['label'] + ' restart files.')
+            log('info', 'Restart files ready.')
+        return candidate['files']
+
+    if not silent:
+        for other, reason in rejected:
+            log('warning', 'Skipping ' + other['label'] + ' restart files of ' + other['prefix'] + ': ' + reason + '.')
+        log('critical' if final else 'warning', 'Restart files empty or missing.' + (' Aborting!' if final else ''))
+    return False
 
 
 def get_restart_step(restart_files):
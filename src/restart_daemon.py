@@ -0,0 +1,209 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from resolve_restart import scan_folder
+from conf_model import NamdConf
+from color_log import log
+from itertools import count
+from time import time
+import socketserver
+import threading
+import signal
+import json
+import os
+
+
+def file_signature(paths):
+    """Get (path, size, mtime) of paths, None for missing ones"""
+
+    signature = list()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            signature.append((path, None, None))
+    return signature
+
+
+class RestartCache:
+    """Folder indexes and parsed conf files kept between requests"""
+
+    def __init__(self):
+        self.folders = dict()
+        self.confs = dict()
+        self.lock = threading.Lock()
+
+    def find(self, path, suffix):
+        """Files on path tree ending with suffix, rescanning only changed folders"""
+
+        path = os.path.abspath(path)
+        index = scan_folder(path, self.folders.get(path))
+        self.folders[path] = index
+
+        found = list()
+        for folder, entry in index.items():
+            found.extend(os.path.join(folder, name) for name in entry['files'] if name.endswith(suffix))
+        return sorted(found)
+
+    def conf(self, path):
+        """Editable copy of a conf file, parsed again only when it or a sourced file changed"""
+
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.confs.get(path)
+
+        if entry is None or file_signature(entry['template'].files()) != entry['signature']:
+            template = NamdConf.read(path)
+            entry = {'template': template, 'signature': file_signature(template.files())}
+            with self.lock:
+                self.confs[path] = entry
+
+        return entry['template'].copy()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answer json requests, one per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                response = self.server.restarter.dispatch(request)
+            except Exception as error:
+                request = dict()
+                response = {'ok': False, 'error': str(error)}
+
+            if isinstance(request, dict) and 'id' in request:
+                response['id'] = request['id']
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class RestartServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server handling each connection on its own thread"""
+
+    daemon_threads = True
+
+
+class RestartDaemon:
+    """Serve prepare, restart and status requests with warm caches"""
+
+    def __init__(self, socket_path, defaults=None):
+        self.socket_path = os.path.abspath(socket_path)
+        self.defaults = dict(defaults or dict())
+        self.cache = RestartCache()
+        self.jobs = dict()
+        self.ids = count(1)
+        self.started = time()
+
+    def options(self, request):
+        """DynamicRestart arguments of a request over the daemon defaults"""
+
+        options = dict(self.defaults)
+        options.update(request.get('options') or dict())
+        if not options.get('previous') or not options.get('restart'):
+            raise ValueError('Request needs "previous" and "restart" options.')
+
+        options.update(pipeline=True, cache=self.cache, batch=False, daemon=None)
+        return options
+
+    def dispatch(self, request):
+        """Answer a request by action"""
+
+        action = request.get('action')
+        if action == 'prepare':
+            return self.prepare(request)
+        if action == 'restart':
+            return self.restart(request)
+        if action == 'status':
+            return self.status(request)
+        return {'ok': False, 'error': 'Unknown action ' + str(action) + '.'}
+
+    def prepare(self, request):
+        """Prepare a restart and write its conf unless write is false"""
+
+        from main import DynamicRestart
+
+        dynamic = DynamicRestart(**self.options(request))
+        result = dynamic.prepare()
+        if result.success and request.get('write', True):
+            dynamic.write()
+        return {'ok': result.success, 'result': result.as_dict()}
+
+    def restart(self, request):
+        """Prepare and write a restart, then run namd in background"""
+
+        from main import DynamicRestart
+
+        options = self.options(request)
+        options['namd'] = True
+        dynamic = DynamicRestart(**options)
+        result = dynamic.prepare()
+        if not result.success:
+            return {'ok': False, 'result': result.as_dict()}
+        dynamic.write()
+
+        job_id = str(next(self.ids))
+        job = {'previous': dynamic.previous, 'conf_path': result.conf_path, 'state': 'running',
+               'started': time(), 'finished': None}
+        self.jobs[job_id] = job
+        threading.Thread(target=self.launch, args=(dynamic, job), daemon=True).start()
+        return {'ok': True, 'job': job_id, 'result': result.as_dict()}
+
+    def launch(self, dynamic, job):
+        """Run namd of a job and record how it ended"""
+
+        try:
+            success = dynamic.launch()
+        except Exception as error:
+            log('error', 'Job on ' + job['previous'] + ' failed: ' + str(error))
+            success = False
+        job.update(state='done' if success else 'failed', finished=time())
+
+    def status(self, request):
+        """Jobs and cache state"""
+
+        jobs = self.jobs
+        if request.get('job'):
+            jobs = {request['job']: self.jobs.get(request['job'])}
+        return {'ok': True, 'uptime': time() - self.started, 'jobs': jobs,
+                'cache': {'folders': len(self.cache.folders), 'confs': len(self.cache.confs)}}
+
+    def serve(self):
+        """Serve requests until interrupted or terminated"""
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server = RestartServer(self.socket_path, RequestHandler)
+        server.restarter = self
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+        log('info', 'Serving restart requests on ' + self.socket_path + '.')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(self.socket_path)
+            log('info', 'Daemon stopped.')
@@ -0,0 +1,138 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import array
+import math
+import mmap
+import sys
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Velocities on namd binary files are in internal units (~20.45 A/ps)
+MAX_VELOCITY = 10.0
+
+
+def psf_atoms(psf):
+    """Get number of atoms from a psf file or None"""
+
+    try:
+        with open(psf) as psf_file:
+            for line in psf_file:
+                if '!NATOM' in line:
+                    return int(line.split()[0])
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def read_header(path):
+    """Get (atoms, byte order) of a namd binary file or None if size does not match"""
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as binary:
+        head = binary.read(4)
+    if len(head) < 4:
+        return None
+
+    for order in ('<', '>'):
+        atoms = struct.unpack(order + 'i', head)[0]
+        if atoms > 0 and size == 4 + 24 * atoms:
+            return atoms, order
+    return None
+
+
+def numpy_error(buffer, atoms, order, limit=None):
+    """Check values of a binary file buffer with numpy, return error or None"""
+
+    # Views of the buffer live only in this frame, so the mmap can be closed once it returns
+    values = numpy.frombuffer(buffer, dtype=order + 'f8', count=3 * atoms, offset=4)
+    if not numpy.isfinite(values).all():
+        return 'NaN or Inf values'
+    if limit is not None:
+        vectors = values.reshape(-1, 3)
+        if numpy.einsum('ij,ij->i', vectors, vectors).max() > limit * limit:
+            return 'velocities above ' + str(limit)
+    return None
+
+
+def check_values(path, atoms, order, limit=None):
+    """Check values are finite and atoms are below limit, return error or None"""
+
+    with open(path, 'rb') as binary, mmap.mmap(binary.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        if numpy is not None:
+            return numpy_error(buffer, atoms, order, limit)
+
+        values = array.array('d', buffer[4:])
+        if (order == '<') != (sys.byteorder == 'little'):
+            values.byteswap()
+
+    if not all(map(math.isfinite, values)):
+        return 'NaN or Inf values'
+    if limit is not None:
+        for i in range(0, len(values), 3):
+            if values[i] ** 2 + values[i + 1] ** 2 + values[i + 2] ** 2 > limit * limit:
+                return 'velocities above ' + str(limit)
+    return None
+
+
+def validate_set(restart_files, atoms=None, max_velocity=MAX_VELOCITY):
+    """Validate binary restart files, return (valid, reason)"""
+
+    counts = dict()
+    for kind in ('coor', 'vel'):
+        path = restart_files.get(kind)
+        if not path:
+            continue
+
+        try:
+            header = read_header(path)
+        except OSError as error:
+            return False, str(error)
+        if header is None:
+            return False, os.path.basename(path) + ' size does not match its atom count'
+
+        counts[kind] = header[0]
+        error = check_values(path, *header, limit=max_velocity if kind == 'vel' else None)
+        if error:
+            return False, os.path.basename(path) + ' has ' + error
+
+    if len(set(counts.values())) > 1:
+        return False, 'coor and vel atom counts differ'
+    if atoms is not None and counts and atoms not in counts.values():
+        return False, 'atom count differs from psf (' + str(atoms) + ')'
+
+    return True, None
+
+
+def validate_sets(sets, atoms=None, max_velocity=MAX_VELOCITY):
+    """Validate several restart sets in parallel threads"""
+
+    if len(sets) < 2:
+        return [validate_set(files, atoms, max_velocity) for files in sets]
+
+    with ThreadPoolExecutor(max_workers=min(len(sets), 8)) as pool:
+        return list(pool.map(lambda files: validate_set(files, atoms, max_velocity), sets))
@@ -0,0 +1,277 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from color_log import log
+from functools import lru_cache
+from time import time
+import threading
+import ctypes.util
+import ctypes
+import select
+import struct
+import os
+
+
+MIN_SPREAD = 2
+MAX_SPREAD = 300
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+EVENT_HEADER = struct.Struct('iIII')
+
+
+@lru_cache(maxsize=None)
+def load_libc():
+    """Load libc for inotify calls or None when unavailable"""
+
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+
+
+def init_inotify():
+    """Return a non blocking inotify descriptor or None when unavailable"""
+
+    libc = load_libc()
+    try:
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC) if libc else -1
+    except AttributeError:
+        return None
+    return fd if fd >= 0 else None
+
+
+def add_watch(fd, folder):
+    """Watch folder for finished writes, return watch descriptor or -1"""
+
+    return load_libc().inotify_add_watch(fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO)
+
+
+def remove_watch(fd, wd):
+    """Stop a folder watch"""
+
+    load_libc().inotify_rm_watch(fd, wd)
+
+
+def open_inotify(folder):
+    """Return an inotify descriptor watching folder or None when unavailable"""
+
+    fd = init_inotify()
+    if fd is None:
+        return None
+
+    if add_watch(fd, folder) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def read_watch_events(fd):
+    """Read pending inotify events and return touched (watch descriptor, file name)"""
+
+    events = set()
+    try:
+        data = os.read(fd, 65536)
+    except BlockingIOError:
+        return events
+
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        events.add((wd, data[offset:offset + length].rstrip(b'\0').decode(errors='replace')))
+        offset += length
+
+    return events
+
+
+def read_events(fd):
+    """Read pending inotify events and return touched file names"""
+
+    return {name for _, name in read_watch_events(fd)}
+
+
+def read_xsc_step(xsc):
+    """Get step from xsc file or None if not readable"""
+
+    try:
+        with open(xsc) as file:
+            for line in file:
+                if line.strip() and not line.startswith('#'):
+                    return int(line.split()[0])
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def written_together(mtimes, reference=None):
+    """Check members {kind: mtime} of a restart set come from one write, reference being the other generation"""
+
+    spread = max(mtimes.values()) - min(mtimes.values())
+    if not reference:
+        return spread <= MAX_SPREAD
+
+    # namd writes one set much faster than the restart interval that separates it from the other generation,
+    # generations that overlap in time mix members of both
+    if min(mtimes.values()) >= max(reference.values()):
+        interval = min(mtimes.values()) - max(reference.values())
+    elif max(mtimes.values()) <= min(reference.values()):
+        interval = min(reference.values()) - max(mtimes.values())
+    else:
+        interval = 0
+    return spread <= max(interval / 2, MIN_SPREAD)
+
+
+class RestartSet:
+    """Track the restart set written by namd for an output name"""
+
+    def __init__(self, output_name):
+        self.files = {kind: output_name + '.restart.' + kind for kind in ('xsc', 'coor', 'vel')}
+        self.names = {os.path.basename(file) for file in self.files.values()}
+        self.last_step = None
+        self.last_mtime = 0
+        self.signature = None
+
+    def changed(self):
+        """Cheap stat check for changes since last call"""
+
+        signature = list()
+        for file in self.files.values():
+            try:
+                stat = os.stat(file)
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append(None)
+
+        changed = signature != self.signature
+        self.signature = signature
+        return changed
+
+    def ready(self):
+        """Return step of a new complete and consistent set or None"""
+
+        mtimes = dict()
+        for kind, file in self.files.items():
+            try:
+                stat = os.stat(file)
+            except OSError:
+                return None
+            if stat.st_size == 0:
+                return None
+            mtimes[kind] = stat.st_mtime
+
+        # All members must be newer than the last set and written together
+        if min(mtimes.values()) <= self.last_mtime or not written_together(mtimes, self.old_mtimes()):
+            return None
+
+        step = read_xsc_step(self.files['xsc'])
+        if step is None or (self.last_step is not None and step <= self.last_step):
+            return None
+
+        return step
+
+    def old_mtimes(self):
+        """Get {kind: mtime} of the .old set namd rotated, None when incomplete"""
+
+        try:
+            return {kind: os.stat(file + '.old').st_mtime for kind, file in self.files.items()}
+        except OSError:
+            return None
+
+    def mark(self, step):
+        """Mark current set as handled"""
+
+        self.last_step = step
+        self.last_mtime = max(os.stat(file).st_mtime for file in self.files.values())
+
+
+class RestartWatcher:
+    """Call back once for each restart set namd finishes writing"""
+
+    def __init__(self, output_name, callback, settle=2, poll=60):
+        self.restart_set = RestartSet(output_name)
+        self.folder = os.path.dirname(os.path.abspath(output_name))
+        self.callback = callback
+        self.settle = settle
+        self.poll = poll
+        self.stop_event = threading.Event()
+        self.wake = os.pipe()
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+
+    def start(self):
+        """Start watching in background"""
+
+        self.thread.start()
+
+    def stop(self):
+        """Stop watching and handle a last set written before exit"""
+
+        self.stop_event.set()
+        os.write(self.wake[1], b'\0')
+        self.thread.join()
+        for fd in self.wake:
+            os.close(fd)
+        self.check()
+
+    def check(self):
+        """Call back for a new complete set"""
+
+        step = self.restart_set.ready()
+        if step is None:
+            return
+
+        try:
+            self.callback(self.restart_set.files, step)
+        except OSError as error:
+            log('warning', 'Could not backup restart files: ' + str(error))
+            return
+        self.restart_set.mark(step)
+
+    def watch(self):
+        """Wait for restart writes with inotify or stat polling"""
+
+        fd = open_inotify(self.folder)
+        # Without inotify fall back to polling only the restart set stats
+        poll = self.poll if fd is not None else min(self.poll, 5)
+        last_event = None
+        last_poll = time()
+
+        try:
+            while not self.stop_event.is_set():
+                timeout = self.settle if last_event else poll
+                if fd is not None:
+                    readable, _, _ = select.select([fd, self.wake[0]], [], [], timeout)
+                    if fd in readable and read_events(fd) & self.restart_set.names:
+                        last_event = time()
+                else:
+                    self.stop_event.wait(timeout)
+
+                # Safety stat check also covers writes inotify cannot see
+                if time() - last_poll >= poll:
+                    last_poll = time()
+                    if self.restart_set.changed():
+                        last_event = last_poll
+
+                if last_event and time() - last_event >= self.settle:
+                    last_event = None
+                    self.check()
+        finally:
+            if fd is not None:
+                os.close(fd)
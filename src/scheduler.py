@@ -0,0 +1,311 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from prepare_dynamic import finish_dynamic, namd_command
+from color_log import log, setup_logging
+from abc import ABC, abstractmethod
+from time import time
+import subprocess
+import argparse
+import shlex
+import json
+import os
+
+
+STATE_FILE = 'scheduler_state.json'
+
+
+def unsupervised_options(args):
+    """Get flags set on args that need namd supervised by the restarter, which submitted jobs are not"""
+
+    options = (('-B/--backup', args.backup), ('-M/--metrics', args.metrics), ('-W/--watchdog', args.watchdog),
+               ('-R/--retries', args.retries), ('-S/--chain-segment', args.chain_segment), ('--scratch', args.scratch),
+               ('-T/--autotune', args.autotune), ('--log-capture', args.log_capture),
+               ('--energy-series', args.energy_series))
+    return [flag for flag, value in options if value]
+
+
+def make_job(namd_exe, output, cores, launch_args=None):
+    """Describe a namd run for output name (folder + file name)"""
+
+    conf = output + '.conf'
+    return {'name': os.path.basename(output), 'workdir': os.path.dirname(output), 'conf': conf,
+            'log': output + '.log', 'err': output + '.err', 'cores': cores,
+            'command': namd_command(namd_exe, conf, cores, args=launch_args)}
+
+
+def job_line(job):
+    """Shell line running a job"""
+
+    return ('cd ' + shlex.quote(job['workdir']) + ' && ' + shlex.join(job['command']) +
+            ' > ' + shlex.quote(job['log']) + ' 2> ' + shlex.quote(job['err']))
+
+
+def read_state(state_dir):
+    """Load submissions recorded on state folder"""
+
+    try:
+        with open(os.path.join(state_dir, STATE_FILE)) as state:
+            return json.load(state)
+    except (OSError, ValueError):
+        return {'submissions': []}
+
+
+class SchedulerBackend(ABC):
+    """Submit namd runs and keep track of them on a state file"""
+
+    name = None
+
+    def __init__(self, state_dir, walltime=None, queue=None, extra=None, array_limit=None):
+        self.state_dir = state_dir
+        self.state_file = os.path.join(state_dir, STATE_FILE)
+        self.walltime = walltime
+        self.queue = queue
+        self.extra = extra or []
+        self.array_limit = array_limit
+
+    def load_state(self):
+        """Load submissions"""
+
+        return read_state(self.state_dir)
+
+    def record(self, submission):
+        """Append a submission to the state file"""
+
+        state = self.load_state()
+        state['submissions'].append(submission)
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self.state_file + '.tmp', 'w') as file:
+            json.dump(state, file, indent=1)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    @abstractmethod
+    def submit(self, jobs):
+        """Submit jobs, return {job conf: job id}"""
+
+    @abstractmethod
+    def status(self, job_ids):
+        """Get {job id: state}"""
+
+
+class LocalBackend(SchedulerBackend):
+    """Run jobs one after the other as child processes"""
+
+    name = 'local'
+
+    def submit(self, jobs):
+        ids = dict()
+        states = dict()
+        stamp = str(int(time()))
+        for index, job in enumerate(jobs):
+            try:
+                with open(job['log'], 'w') as out, open(job['err'], 'w') as err:
+                    returncode = subprocess.run(job['command'], stdout=out, stderr=err, cwd=job['workdir']).returncode
+            except (PermissionError, FileNotFoundError):
+                log('error', 'Namd exe not found! Please specify path with -e.')
+                returncode = None
+
+            job_id = 'local-' + job['name'] + '-' + stamp + '_' + str(index)
+            ids[job['conf']] = job_id
+            ok = returncode is not None and finish_dynamic(job['err'], returncode=returncode)
+            states[job_id] = 'COMPLETED' if ok else 'FAILED'
+
+        self.record({'backend': self.name, 'submitted': time(), 'jobs': jobs, 'ids': ids, 'states': states})
+        return ids
+
+    def status(self, job_ids):
+        states = dict()
+        for submission in self.load_state()['submissions']:
+            states.update(submission.get('states', {}))
+        return {job_id: states.get(job_id, 'UNKNOWN') for job_id in job_ids}
+
+
+class BatchBackend(SchedulerBackend):
+    """Submit jobs as one array script to a cluster scheduler"""
+
+    submit_cmd = None
+    index_var = None
+
+    @abstractmethod
+    def directives(self, jobs):
+        """Scheduler directives for the array script"""
+
+    def parse_id(self, output):
+        """Get array id from submit output"""
+
+        return output.strip().split(';')[0]
+
+    @abstractmethod
+    def task_id(self, array_id, index):
+        """Id of one array task"""
+
+    def script(self, jobs):
+        """Render array job script"""
+
+        lines = ['#!/bin/bash', *self.directives(jobs), '',
+                 'case "${' + self.index_var + ':-0}" in']
+        for index, job in enumerate(jobs):
+            lines.append('    ' + str(index) + ') ' + job_line(job) + ' ;;')
+        lines.append('esac')
+        return '\n'.join(lines) + '\n'
+
+    def submit(self, jobs):
+        os.makedirs(self.state_dir, exist_ok=True)
+        script = os.path.join(self.state_dir, 'restart_' + self.name + '_' + str(int(time() * 1000)) + '.sh')
+        with open(script, 'w') as file:
+            file.write(self.script(jobs))
+
+        try:
+            output = subprocess.run([self.submit_cmd, script], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    check=True)
+        except FileNotFoundError:
+            log('error', self.submit_cmd + ' not found. Is ' + self.name + ' available here?')
+            return dict()
+        except subprocess.CalledProcessError as error:
+            log('error', self.submit_cmd + ' failed: ' + error.stderr.decode(errors='replace').strip())
+            return dict()
+
+        array_id = self.parse_id(output.stdout.decode())
+        ids = {job['conf']: self.task_id(array_id, index) for index, job in enumerate(jobs)}
+
+        self.record({'backend': self.name, 'submitted': time(), 'script': script, 'array_id': array_id,
+                     'jobs': jobs, 'ids': ids})
+        log('info', 'Submitted ' + str(len(jobs)) + ' namd runs as ' + self.name + ' job ' + array_id + '.')
+        return ids
+
+
+class SlurmBackend(BatchBackend):
+    """Submit array jobs with sbatch and follow them with squeue"""
+
+    name = 'slurm'
+    submit_cmd = 'sbatch'
+    index_var = 'SLURM_ARRAY_TASK_ID'
+
+    def directives(self, jobs):
+        array = '0-' + str(len(jobs) - 1) + ('%' + str(self.array_limit) if self.array_limit else '')
+        directives = ['#SBATCH --parsable', '#SBATCH --job-name=namd_restart', '#SBATCH --array=' + array,
+                      '#SBATCH --ntasks=1', '#SBATCH --cpus-per-task=' + str(max(job['cores'] for job in jobs)),
+                      '#SBATCH --output=' + os.path.join(self.state_dir, 'slurm-%A_%a.out')]
+        if self.walltime:
+            directives.append('#SBATCH --time=' + self.walltime)
+        if self.queue:
+            directives.append('#SBATCH --partition=' + self.queue)
+        return directives + ['#SBATCH ' + option for option in self.extra]
+
+    def parse_id(self, output):
+        return output.strip().splitlines()[-1].split(';')[0]
+
+    def task_id(self, array_id, index):
+        return array_id + '_' + str(index)
+
+    def status(self, job_ids):
+        arrays = sorted({job_id.split('_')[0] for job_id in job_ids})
+        states = dict()
+        try:
+            output = subprocess.run(['squeue', '-h', '-r', '-o', '%i %T', '-j', ','.join(arrays)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode()
+        except FileNotFoundError:
+            output = ''
+
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                states[parts[0]] = parts[1]
+        return {job_id: states.get(job_id, 'FINISHED') for job_id in job_ids}
+
+
+class PBSBackend(BatchBackend):
+    """Submit array jobs with qsub and follow them with qstat"""
+
+    name = 'pbs'
+    submit_cmd = 'qsub'
+    index_var = 'PBS_ARRAY_INDEX'
+
+    def directives(self, jobs):
+        directives = ['#PBS -N namd_restart', '#PBS -l select=1:ncpus=' + str(max(job['cores'] for job in jobs)),
+                      '#PBS -o ' + self.state_dir, '#PBS -j oe']
+        # PBS arrays need at least two tasks, a single job runs as index 0
+        if len(jobs) > 1:
+            directives.append('#PBS -J 0-' + str(len(jobs) - 1))
+        if self.walltime:
+            directives.append('#PBS -l walltime=' + self.walltime)
+        if self.queue:
+            directives.append('#PBS -q ' + self.queue)
+        return directives + ['#PBS ' + option for option in self.extra]
+
+    def task_id(self, array_id, index):
+        if '[]' not in array_id:
+            return array_id
+        return array_id.replace('[]', '[' + str(index) + ']')
+
+    def status(self, job_ids):
+        states = dict()
+        try:
+            output = subprocess.run(['qstat', '-t', '-x', *job_ids], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL).stdout.decode()
+        except FileNotFoundError:
+            output = ''
+
+        codes = {'Q': 'PENDING', 'R': 'RUNNING', 'F': 'FINISHED', 'E': 'EXITING', 'H': 'HELD', 'B': 'RUNNING'}
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) >= 5 and parts[0] in job_ids:
+                states[parts[0]] = codes.get(parts[4], parts[4])
+        return {job_id: states.get(job_id, 'FINISHED') for job_id in job_ids}
+
+
+BACKENDS = {'local': LocalBackend, 'slurm': SlurmBackend, 'pbs': PBSBackend}
+
+
+def get_backend(name, state_dir, walltime=None, queue=None, extra=None, array_limit=None):
+    """Create scheduler backend by name"""
+
+    return BACKENDS[name](state_dir, walltime, queue, extra, array_limit)
+
+
+def job_states(state_dir):
+    """Get {job conf: (job id, state)} of every submission recorded on state folder, newest first"""
+
+    jobs = dict()
+    for submission in reversed(read_state(state_dir)['submissions']):
+        states = get_backend(submission['backend'], state_dir).status(list(submission['ids'].values()))
+        for conf, job_id in submission['ids'].items():
+            jobs.setdefault(conf, (job_id, states[job_id]))
+    return jobs
+
+
+def main():
+    """Command line for following submitted restarts"""
+
+    parser = argparse.ArgumentParser(description='Show the state of restarts submitted to a scheduler.')
+    parser.add_argument('output', help='Batch output folder holding ' + STATE_FILE)
+    args = parser.parse_args()
+    setup_logging()
+
+    jobs = job_states(args.output)
+    if not jobs:
+        log('warning', 'No submissions recorded on ' + args.output + '.')
+        return
+    for conf, (job_id, state) in sorted(jobs.items()):
+        log('info', job_id + ' ' + state + ' ' + conf)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from backup_store import fast_copy
+from conf_model import NamdConf
+from color_log import log
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import shutil
+import signal
+import os
+
+
+INPUT_OPTIONS = ['structure', 'coordinates', 'velocities', 'parameters', 'parmfile', 'ambercoor',
+                 'bincoordinates', 'binvelocities', 'extendedsystem', 'consref', 'conskfile', 'fixedatomsfile']
+OUTPUT_OPTIONS = ['dcdfile', 'veldcdfile', 'forcedcdfile', 'xstfile', 'restartname']
+APPEND_ONLY = ('.dcd', '.xst', '.log')
+HEADER = 4096
+
+
+def mark_modified(conf):
+    """Mark conf and its sourced files to be written next to the saved conf"""
+
+    conf.modified = True
+    for _, include in conf.includes:
+        mark_modified(include)
+
+
+def replace_value(conf, line, value):
+    """Replace the value of an option line keeping its keyword"""
+
+    text = line.text.rstrip('\r\n')
+    indent = text[:len(text) - len(text.lstrip())]
+    conf.edit(line, indent + text.split()[0] + ' ' + value)
+
+
+def sync_file(source, target):
+    """Bring target up to date with source, appending to growing trajectories"""
+
+    size = os.path.getsize(source)
+    if source.endswith(APPEND_ONLY) and os.path.exists(target) and os.path.getsize(target) <= size:
+        # Only the tail is new, plus the header frame counts of dcd files
+        done = os.path.getsize(target)
+        with open(source, 'rb') as src, open(target, 'r+b') as dst:
+            dst.write(src.read(min(HEADER, done)))
+            src.seek(done)
+            dst.seek(done)
+            shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+        return
+
+    # Replace whole files through a rename so readers never see them partial
+    fast_copy(source, target + '.sync')
+    os.replace(target + '.sync', target)
+
+
+class OutputSync:
+    """Copy namd output from scratch back to the output folder periodically"""
+
+    def __init__(self, scratch, target, interval=300):
+        self.scratch = scratch
+        self.target = target
+        self.interval = interval
+        self.synced = dict()
+        self.failed = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.follow, daemon=True)
+
+    def start(self):
+        """Start syncing in background"""
+
+        self.thread.start()
+
+    def stop(self):
+        """Stop syncing and flush everything left"""
+
+        self.stop_event.set()
+        self.thread.join()
+        self.sync()
+
+    def sync(self):
+        """Copy output files changed since last sync"""
+
+        self.failed = False
+        try:
+            entries = [entry for entry in os.scandir(self.scratch) if entry.is_file()]
+        except OSError:
+            return
+
+        # Restart sets go last so their files are never older than the trajectory
+        entries.sort(key=lambda entry: '.restart.' in entry.name)
+        for entry in entries:
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.synced.get(entry.name) == signature:
+                continue
+            try:
+                sync_file(entry.path, os.path.join(self.target, entry.name))
+                self.synced[entry.name] = signature
+            except OSError as error:
+                self.failed = True
+                log('warning', 'Could not sync ' + entry.name + ': ' + str(error))
+
+    def follow(self):
+        """Sync every interval"""
+
+        while not self.stop_event.wait(self.interval):
+            self.sync()
+
+
+class Stage:
+    """Restart inputs copied to node local scratch with a conf pointing at them"""
+
+    def __init__(self, conf_path, scratch, base_folder, file_name, interval=300):
+        self.folder = os.path.join(os.path.abspath(scratch), 'namd_restarter_' + file_name + '_' + str(os.getpid()))
+        self.inputs = os.path.join(self.folder, 'inputs')
+        self.output = os.path.join(self.folder, 'output')
+        self.conf = os.path.join(self.folder, file_name + '.conf')
+        self.conf_path = conf_path
+        self.base_folder = base_folder
+        self.file_name = file_name
+        self.sync = OutputSync(self.output, os.path.dirname(os.path.abspath(conf_path)), interval)
+
+    def resolve(self, conf, value):
+        """Absolute path of a conf value"""
+
+        path = conf.substitute(value)
+        if not os.path.isabs(path):
+            path = os.path.join(self.base_folder, path)
+        return os.path.normpath(path)
+
+    def prepare(self):
+        """Copy referenced inputs in parallel and write the staged conf, return its path"""
+
+        os.makedirs(self.inputs, exist_ok=True)
+        os.makedirs(self.output, exist_ok=True)
+        conf = NamdConf.read(self.conf_path)
+
+        copies = dict()
+        edits = list()
+        for option in INPUT_OPTIONS:
+            for line in conf.find_all(option):
+                values = line.values()
+                if not values:
+                    continue
+                source = self.resolve(conf, values[0].split()[0])
+                if not os.path.isfile(source):
+                    continue
+                if source not in copies:
+                    name = os.path.basename(source)
+                    if any(os.path.basename(local) == name for local in copies.values()):
+                        name = str(len(copies)) + '_' + name
+                    copies[source] = os.path.join(self.inputs, name)
+                edits.append((line, copies[source]))
+
+        with ThreadPoolExecutor(max_workers=min(8, len(copies) or 1)) as pool:
+            list(pool.map(fast_copy, copies.keys(), copies.values()))
+        size = sum(os.path.getsize(local) for local in copies.values())
+        log('info', 'Staged ' + str(len(copies)) + ' input files (' + format(size / 1e6, '.1f') + ' MB) on ' +
+            self.folder + '.')
+
+        for line, local in edits:
+            replace_value(conf, line, local)
+
+        output_name = os.path.join(self.output, self.file_name)
+        conf.set('set outputname ' + output_name)
+        for line in conf.find_all('outputname'):
+            replace_value(conf, line, output_name)
+        for option in OUTPUT_OPTIONS:
+            for line in conf.find_all(option):
+                values = line.values()
+                if values:
+                    replace_value(conf, line, os.path.join(self.output, os.path.basename(values[0].split()[0])))
+
+        mark_modified(conf)
+        conf.save(self.conf)
+        return self.conf
+
+    def start(self):
+        """Start syncing output back"""
+
+        self.sync.start()
+
+    def finish(self):
+        """Flush output back and remove scratch folder"""
+
+        self.sync.stop()
+        if self.sync.failed:
+            log('error', 'Output left on scratch at ' + self.output + ' after sync errors.')
+            return False
+        shutil.rmtree(self.folder, ignore_errors=True)
+        log('info', 'Synced output back from scratch.')
+        return True
+
+
+def forward_sigterm(process):
+    """Terminate process on SIGTERM, return previous handler or None off the main thread"""
+
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    return signal.signal(signal.SIGTERM, lambda *_: process.terminate())
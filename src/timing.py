@@ -0,0 +1,61 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from color_log import log
+from contextlib import contextmanager
+from time import time, perf_counter
+import json
+
+
+class PhaseTimer:
+    """Time restart phases and export them as json lines"""
+
+    def __init__(self, path=None, system=None):
+        self.path = path
+        self.system = system
+        self.phases = dict()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block as phase name"""
+
+        start = time()
+        counter = perf_counter()
+        status = 'ok'
+        try:
+            yield
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            duration = perf_counter() - counter
+            self.phases[name] = duration
+            log('info' if self.path else 'debug', 'Phase ' + name + ' took ' + format(duration, '.3f') + 's.')
+            self.write({'phase': name, 'start': start, 'duration': duration, 'status': status})
+
+    def write(self, record):
+        """Append record to timing file"""
+
+        if not self.path:
+            return
+
+        record['system'] = self.system
+        with open(self.path, 'a') as timing:
+            timing.write(json.dumps(record) + '\n')
@@ -0,0 +1,95 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+import struct
+import sys
+import os
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+XSC_HEADER = ('# NAMD extended system configuration restart file\n'
+              '#$LABELS step a_x a_y a_z b_x b_y b_z c_x c_y c_z o_x o_y o_z\n')
+
+
+def write_binary(path, vectors, order='<'):
+    """Write a namd binary coor/vel file from (x, y, z) tuples"""
+
+    with open(path, 'wb') as binary:
+        binary.write(struct.pack(order + 'i', len(vectors)))
+        for vector in vectors:
+            binary.write(struct.pack(order + '3d', *vector))
+
+
+def write_xsc(path, step):
+    """Write a namd xsc file for step"""
+
+    with open(path, 'w') as xsc:
+        xsc.write(XSC_HEADER + str(step) + ' 50 0 0 0 50 0 0 0 50 0 0 0\n')
+
+
+def write_set(folder, prefix, step, atoms=4, tag=None, velocity=0.5):
+    """Write a complete restart set, return {kind: path}"""
+
+    os.makedirs(folder, exist_ok=True)
+    suffix = '.' + tag if tag else ''
+    files = {kind: os.path.join(folder, prefix + '.restart.' + kind + suffix) for kind in ('coor', 'vel', 'xsc')}
+    write_binary(files['coor'], [(float(i), 1.0, 2.0) for i in range(atoms)])
+    write_binary(files['vel'], [(velocity, 0.0, 0.0)] * atoms)
+    write_xsc(files['xsc'], step)
+    return files
+
+
+@pytest.fixture
+def restart_set(tmp_path):
+    """A complete restart set of 4 atoms at step 1000"""
+
+    return write_set(str(tmp_path), 'prod', 1000)
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def validator(request, monkeypatch):
+    """restart_validator with numpy, when installed, or with its pure python fallback"""
+
+    import restart_validator
+
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(restart_validator, 'numpy', None)
+    return restart_validator
+
+
+@pytest.fixture
+def stub(tmp_path):
+    """Write an executable python script standing in for namd or a scheduler command, return its path"""
+
+    folder = tmp_path / 'bin'
+    folder.mkdir(exist_ok=True)
+
+    def write_stub(name, body):
+        path = folder / name
+        path.write_text('#!' + sys.executable + '\nimport sys\n' + body)
+        path.chmod(0o755)
+        return str(path)
+
+    return write_stub
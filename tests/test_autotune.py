@@ -0,0 +1,89 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from autotune import autotune, candidates, cache_key, load_cache
+import os
+
+import pytest
+
+
+# Stand-in namd: faster with more +p cores, pinning helps, every call is counted
+NAMD = '''
+args = sys.argv[1:-1]
+cores = int(next(arg for arg in args if arg.startswith('+p'))[2:])
+seconds = 0.08 / cores * (0.9 if '+setcpuaffinity' in args else 1)
+with open(sys.argv[0] + '.calls', 'a') as calls:
+    calls.write(' '.join(args) + '\\n')
+print('TIMING: 100  CPU: 1.0, 0.01/step  Wall: 1.0, ' + format(seconds, '.5f') + '/step, 0.1 hours remaining, '
+      '100.0 MB of memory in use.')
+'''
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    """A restart conf with an empty autotune cache"""
+
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    path = tmp_path / 'prod.conf'
+    path.write_text('structure sys.psf\noutputName prod\ndcdfreq 500\nrestartfreq 500\ntimestep 2.0\nrun 10000\n')
+    return str(path)
+
+
+def calls(namd):
+    """Launch arguments the stub namd was run with"""
+
+    if not os.path.exists(namd + '.calls'):
+        return []
+    with open(namd + '.calls') as file:
+        return file.read().splitlines()
+
+
+def test_candidates():
+    assert candidates(4) == [['+p1'], ['+p1', '+setcpuaffinity'], ['+p2'], ['+p2', '+setcpuaffinity'],
+                             ['+p4'], ['+p4', '+setcpuaffinity']]
+    assert ['+p2', '+ppn', '2', '+setcpuaffinity'] in candidates(2, ppn=True)
+
+
+def test_cache_key():
+    assert cache_key(12345, 4) == cache_key(12001, 4)
+    assert cache_key(12345, 4) != cache_key(12345, 2)
+    assert cache_key(12345, 4) != cache_key(12345, 4, ppn=True)
+
+
+def test_autotune_picks_fastest_and_caches(conf, stub):
+    namd = stub('namd', NAMD)
+    assert autotune(namd, conf, 12345, 4, steps=100) == ['+p4', '+setcpuaffinity']
+    assert len(calls(namd)) == 6
+    assert not os.path.exists(os.path.join(os.path.dirname(conf), 'autotune'))
+
+    # Same system size and budget reuse the result without benchmarks
+    assert autotune(namd, conf, 12300, 4, steps=100) == ['+p4', '+setcpuaffinity']
+    assert len(calls(namd)) == 6
+
+    # A smaller budget never reuses settings tuned for more cores
+    assert autotune(namd, conf, 12345, 2, steps=100) == ['+p2', '+setcpuaffinity']
+    assert len(calls(namd)) == 10
+    assert len(load_cache()) == 2
+
+
+def test_autotune_without_timings(conf, stub):
+    namd = stub('namd', 'print("Info: no timing")\n')
+    assert autotune(namd, conf, 12345, 2, steps=100) is None
+    assert load_cache() == {}
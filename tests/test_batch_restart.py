@@ -0,0 +1,48 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from arguments_parser import make_parser
+from batch_restart import glob_root, read_systems, unsupported_options
+import os
+
+
+def test_glob_root():
+    assert glob_root('runs/*/prod') == 'runs'
+    assert glob_root('*') == '.'
+    assert glob_root('runs/a') == 'runs'
+
+
+def test_read_systems(tmp_path):
+    for name in ('a', 'b'):
+        os.makedirs(str(tmp_path / 'runs' / name / 'prod'))
+    systems = read_systems(str(tmp_path / 'runs' / '*' / 'prod'), 'out')
+    assert [restart for _, restart in systems] == [os.path.join('out', 'a', 'prod'), os.path.join('out', 'b', 'prod')]
+
+    manifest = tmp_path / 'manifest'
+    manifest.write_text('runs/a/prod  # first\n\nruns/b/prod restarts/b\n')
+    assert read_systems(str(manifest), 'out') == [('runs/a/prod', os.path.join('out', 'prod')),
+                                                  ('runs/b/prod', 'restarts/b')]
+
+
+def test_unsupported_options():
+    parser = make_parser()
+    assert unsupported_options(parser.parse_args(['-i', 'runs/*', '-o', 'out', '-b'])) == []
+    args = parser.parse_args(['-i', 'runs/*', '-o', 'out', '-b', '-R', '2', '--energy-series'])
+    assert unsupported_options(args) == ['-R/--retries', '--energy-series']
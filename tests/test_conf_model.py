@@ -0,0 +1,118 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from conftest import write_set
+from conf_model import NamdConf
+from main import DynamicRestart
+import os
+
+
+def write(path, text):
+    """Write text file"""
+
+    with open(path, 'w') as file:
+        file.write(text)
+
+
+def read(path):
+    """Read text file"""
+
+    with open(path) as file:
+        return file.read()
+
+
+def sourced_conf(folder):
+    """Write a conf whose inputs and run length are in a sourced file"""
+
+    write(os.path.join(folder, 'inputs.inp'), 'structure sys.psf\ncoordinates sys.pdb\ntimestep 2.0\nrun 10000\n')
+    write(os.path.join(folder, 'prod.conf'), 'source inputs.inp\nset outputname prod\noutputName $outputname\n'
+                                             'temperature 310\nfirsttimestep 0\nrestartfreq 500\n')
+    return os.path.join(folder, 'prod.conf')
+
+
+def test_find_and_value(tmp_path):
+    conf = NamdConf.read(sourced_conf(str(tmp_path)))
+    assert conf.value('run') == '10000'
+    assert conf.value('outputname') == 'prod'
+    assert conf.value('Timestep') == '2.0'
+    assert conf.value('minimize', 'none') == 'none'
+
+
+def test_set_edits_sourced_file(tmp_path):
+    conf = NamdConf.read(sourced_conf(str(tmp_path)))
+    conf.set('run 5000')
+    conf.set('restartfreq 1000')
+    conf.set('outputenergies 100')
+
+    output = tmp_path / 'out'
+    output.mkdir()
+    conf.save(str(output / 'prod.conf'))
+
+    main, inputs = read(str(output / 'prod.conf')), read(str(output / 'inputs.inp'))
+    assert 'run' not in main.split()
+    assert 'run 5000\n' in inputs
+    assert 'restartfreq 1000\n' in main
+    assert 'outputenergies 100\n' in main
+    assert 'source ' + str(output / 'inputs.inp') in main
+
+
+def test_insert_after_sourced_line(tmp_path):
+    conf = NamdConf.read(sourced_conf(str(tmp_path)))
+    anchor = conf.insert('', conf.find('coordinates'))
+    conf.set('bincoordinates restart.coor', anchor)
+
+    output = tmp_path / 'out'
+    output.mkdir()
+    conf.save(str(output / 'prod.conf'))
+
+    inputs = read(str(output / 'inputs.inp'))
+    assert inputs.index('bincoordinates restart.coor') > inputs.index('coordinates sys.pdb')
+    assert conf.owner(anchor) is conf.includes[0][1]
+
+
+def test_comment_keeps_prose(tmp_path):
+    path = str(tmp_path / 'prod.conf')
+    write(path, '# Restart run\r\ntemperature 310\r\nminimize 100\r\nrun 10\r\n')
+    conf = NamdConf.read(path)
+    assert conf.comment('minimize')
+    assert not conf.comment('reinitvels')
+    conf.save(path)
+
+    with open(path, newline='') as file:
+        assert file.read() == '# Restart run\r\ntemperature 310\r\n#minimize 100\r\nrun 10\r\n'
+
+
+def test_restart_with_sourced_inputs(tmp_path):
+    previous, restart = str(tmp_path / 'previous'), str(tmp_path / 'restart')
+    files = write_set(previous, 'prod', 4000)
+    write(os.path.join(previous, 'inputs.inp'), 'structure sys.psf\ncoordinates sys.pdb\n')
+    write(os.path.join(previous, 'prod.conf'), 'source inputs.inp\noutputName prod\ntemperature 310\n'
+                                               'firsttimestep 0\nrun 10000\n')
+    write(os.path.join(previous, 'sys.psf'), 'PSF\n\n       4 !NATOM\n')
+
+    dynamic = DynamicRestart(previous=previous, restart=restart, namd=False, conf=None, options=[], run=None)
+    assert dynamic.execute()
+
+    main = read(os.path.join(restart, 'prod.conf'))
+    restart_conf = main + read(os.path.join(restart, 'inputs.inp'))
+    for option in ('bincoordinates ' + files['coor'], 'binvelocities ' + files['vel'],
+                   'extendedSystem ' + files['xsc'], 'firsttimestep 4000', 'run 6000'):
+        assert restart_conf.count(option + '\n') == 1
+    assert '#temperature 310' in main
@@ -0,0 +1,61 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from conftest import write_set
+from conf_model import NamdConf
+from io_advisor import advise_io, optimal_interval, round_steps, MIN_INTERVAL
+import os
+
+
+def previous_run(folder, restartfreq):
+    """Write a previous run stepping at 0.01 s/step"""
+
+    files = write_set(folder, 'prod', 1000)
+    with open(os.path.join(folder, 'prod.log'), 'w') as log_file:
+        for step in range(100, 1100, 100):
+            log_file.write('TIMING: ' + str(step) + '  CPU: 1.0, 0.01/step  Wall: 1.0, 0.01/step, 0.1 hours '
+                           'remaining, 100.0 MB of memory in use.\n')
+    path = os.path.join(folder, 'prod.conf')
+    with open(path, 'w') as conf:
+        conf.write('stepspercycle 20\nrestartfreq ' + str(restartfreq) + '\nrun 10000\n')
+    return NamdConf.read(path), files
+
+
+def test_young_daly():
+    assert round(optimal_interval(1, 86400)) == 415
+    assert optimal_interval(50000, 86400) == 86400
+    assert round_steps(45, 20) == 40
+    assert round_steps(3, 20) == 20
+
+
+def test_restartfreq_floor(tmp_path):
+    folder = str(tmp_path)
+    conf, files = previous_run(folder, 500)
+    advice = advise_io(conf, files, folder, folder)
+
+    floor = MIN_INTERVAL / 0.01
+    assert advice['restartfreq'] >= floor
+    assert advice['restartfreq'] % 20 == 0
+
+
+def test_restartfreq_kept(tmp_path):
+    folder = str(tmp_path)
+    conf, files = previous_run(folder, 30000)
+    assert 'restartfreq' not in advise_io(conf, files, folder, folder)
@@ -0,0 +1,52 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from conftest import write_set
+from main import DynamicRestart
+import os
+
+
+def previous_run(folder):
+    """Write a previous run with a restart set at step 4000"""
+
+    write_set(folder, 'prod', 4000)
+    with open(os.path.join(folder, 'prod.conf'), 'w') as conf:
+        conf.write('structure sys.psf\ncoordinates sys.pdb\noutputName prod\ntemperature 310\nrun 10000\n')
+
+
+def test_prepare_has_no_side_effects(tmp_path):
+    previous, restart = str(tmp_path / 'previous'), str(tmp_path / 'restart')
+    previous_run(previous)
+    os.makedirs(restart)
+
+    result = DynamicRestart(previous=previous, restart=restart, namd=False).prepare()
+    assert result.success
+    assert result.restart_step == 4000
+    assert 'firsttimestep 4000' in result.conf_text
+    assert os.listdir(restart) == []
+
+
+def test_execute_writes_conf(tmp_path):
+    previous, restart = str(tmp_path / 'previous'), str(tmp_path / 'restart')
+    previous_run(previous)
+
+    dynamic = DynamicRestart(previous=previous, restart=restart, namd=False)
+    assert dynamic.execute()
+    assert os.path.isfile(os.path.join(restart, 'prod.conf'))
@@ -0,0 +1,45 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from prepare_dynamic import finish_dynamic, namd_command, format_option
+
+
+def test_finish_dynamic(tmp_path):
+    err = tmp_path / 'prod.err'
+    err.write_text('')
+    assert finish_dynamic(str(err))
+    assert not finish_dynamic(str(err), returncode=1)
+    assert not finish_dynamic(str(err), stopped='diverged at step 5300')
+
+    err.write_text('FATAL ERROR: atoms moving too fast\n')
+    assert not finish_dynamic(str(err))
+    assert finish_dynamic(str(err), err_message='')
+
+
+def test_namd_command():
+    assert namd_command('namd', 'prod.conf', 1) == ['namd', 'prod.conf']
+    assert namd_command('namd', 'prod.conf', 4, '0-3') == ['namd', '+setcpuaffinity', '+pemap', '0-3', '+p4',
+                                                           'prod.conf']
+    assert namd_command('namd', 'prod.conf', 4, args=['+p2']) == ['namd', '+p2', 'prod.conf']
+
+
+def test_format_option():
+    assert format_option('set  temp 310') == ['set temp', '310']
+    assert format_option('run 1000') == ['run', '1000']
@@ -0,0 +1,129 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from conftest import write_set
+from resolve_restart import search_previous, get_restart_step, index_restart, restart_stages, pick_stage
+from restart_watcher import written_together
+import os
+
+
+def touch(files, mtime):
+    """Set mtime of restart files"""
+
+    for path in files.values():
+        os.utime(path, (mtime, mtime))
+
+
+def test_written_together():
+    assert written_together({'coor': 1000, 'vel': 1001, 'xsc': 1001})
+    assert written_together({'coor': 1000, 'vel': 1030, 'xsc': 1031}, {'coor': 400, 'vel': 401, 'xsc': 402})
+    assert not written_together({'coor': 1600, 'vel': 1000, 'xsc': 1000}, {'coor': 400, 'vel': 400, 'xsc': 400})
+    # Copies without preserved times interleave both generations
+    assert written_together({'coor': 10.3, 'vel': 10.4, 'xsc': 10.5}, {'coor': 10.2, 'vel': 10.6, 'xsc': 10.7})
+    assert not written_together({'coor': 1000, 'vel': 1400, 'xsc': 1400})
+
+
+def test_newest_consistent_set(tmp_path):
+    folder = str(tmp_path)
+    touch(write_set(folder, 'prod', 1000, tag='old'), 1000)
+    current = write_set(folder, 'prod', 2000)
+    touch(current, 1200)
+
+    assert search_previous(folder, silent=True) == current
+    assert get_restart_step(current) == '2000'
+
+
+def test_mixed_generation_rejected(tmp_path):
+    # Restarts every 120 s, the coor of a newer write is mixed with the vel and xsc of the last one
+    folder = str(tmp_path)
+    old = write_set(folder, 'prod', 1000, tag='old')
+    touch(old, 1000)
+    current = write_set(folder, 'prod', 2000)
+    touch(current, 1120)
+    os.utime(current['coor'], (1240, 1240))
+
+    assert search_previous(folder, silent=True) == old
+
+
+def test_crash_during_rotation(tmp_path):
+    # namd renamed and rewrote coor, then stopped before rotating vel and xsc
+    folder = str(tmp_path)
+    older = {'coor': 1000, 'vel': 1001, 'xsc': 1002}
+    newer = {'coor': 1120, 'vel': 1121, 'xsc': 1122}
+    old = write_set(folder, 'prod', 1000, tag='old')
+    current = write_set(folder, 'prod', 2000)
+    for kind in ('vel', 'xsc'):
+        os.utime(old[kind], (older[kind], older[kind]))
+        os.utime(current[kind], (newer[kind], newer[kind]))
+    os.utime(old['coor'], (newer['coor'], newer['coor']))
+    os.utime(current['coor'], (1240, 1240))
+
+    assert search_previous(folder, silent=True) is False
+
+
+def test_no_restart_files(tmp_path):
+    assert search_previous(str(tmp_path), silent=True) is False
+
+
+def test_empty_current_falls_back_to_old(tmp_path):
+    folder = str(tmp_path)
+    old = write_set(folder, 'prod', 1000, tag='old')
+    touch(old, 1000)
+    current = write_set(folder, 'prod', 2000)
+    open(current['coor'], 'w').close()
+    touch(current, 1120)
+
+    assert search_previous(folder, silent=True) == old
+
+
+def test_before_step(tmp_path):
+    folder = str(tmp_path)
+    old = write_set(folder, 'prod', 1000, tag='old')
+    touch(old, 1000)
+    touch(write_set(folder, 'prod', 2000), 1120)
+
+    assert search_previous(folder, silent=True, before=2000) == old
+    assert search_previous(folder, silent=True, before=1000) is False
+
+
+def test_numbered_backup(tmp_path):
+    folder = str(tmp_path)
+    backup = write_set(os.path.join(folder, 'backups'), 'prod', 3000, tag='2')
+    touch(backup, 1000)
+    touch(write_set(folder, 'prod', 2000), 1120)
+
+    assert search_previous(folder, silent=True) == backup
+
+
+def test_stages(tmp_path):
+    folder = str(tmp_path)
+    touch(write_set(os.path.join(folder, 'equil'), 'npt', 5000), 2000)
+    touch(write_set(os.path.join(folder, 'prod'), 'prod', 1000), 3000)
+    touch(write_set(os.path.join(folder, 'prod', 'backups'), 'prod', 500, tag='1'), 2500)
+
+    stages = restart_stages(index_restart(folder, folders=dict()), folder)
+    assert [(stage['name'], stage['step']) for stage in stages] == [('equil/npt', 5000), ('prod/prod', 1000)]
+    assert pick_stage(stages)['name'] == 'equil/npt'
+    assert pick_stage(stages, 'recent')['name'] == 'prod/prod'
+    assert pick_stage(stages, 'prod')['name'] == 'prod/prod'
+    assert pick_stage(stages, 'missing') is None
+
+    files = search_previous(folder, silent=True, stage='prod/prod', before=1000)
+    assert files['xsc'] == os.path.join(folder, 'prod', 'backups', 'prod.restart.xsc.1')
@@ -0,0 +1,79 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from conftest import write_binary, write_set
+import math
+
+
+def test_valid_set(validator, restart_set):
+    assert validator.validate_set(restart_set) == (True, None)
+    assert validator.validate_set(restart_set, atoms=4) == (True, None)
+
+
+def test_check_values_releases_buffer(validator, restart_set):
+    # Runs twice so an exported buffer left on the first mmap would raise on close
+    for _ in range(2):
+        assert validator.check_values(restart_set['vel'], 4, '<', limit=10.0) is None
+
+
+def test_big_endian(validator, restart_set):
+    write_binary(restart_set['coor'], [(1.0, 2.0, 3.0)] * 4, order='>')
+    write_binary(restart_set['vel'], [(0.1, 0.2, 0.3)] * 4, order='>')
+    assert validator.read_header(restart_set['coor']) == (4, '>')
+    assert validator.validate_set(restart_set) == (True, None)
+
+
+def test_non_finite_values(validator, restart_set):
+    write_binary(restart_set['coor'], [(1.0, math.nan, 3.0)] * 4)
+    valid, reason = validator.validate_set(restart_set)
+    assert not valid
+    assert 'NaN or Inf' in reason
+
+
+def test_fast_atoms(validator, restart_set):
+    write_binary(restart_set['vel'], [(0.0, 0.0, 0.0)] * 3 + [(20.0, 0.0, 0.0)])
+    valid, reason = validator.validate_set(restart_set)
+    assert not valid
+    assert 'velocities above' in reason
+
+
+def test_truncated_file(validator, restart_set):
+    with open(restart_set['coor'], 'r+b') as binary:
+        binary.truncate(4 + 24 * 3)
+    valid, reason = validator.validate_set(restart_set)
+    assert not valid
+    assert 'size does not match' in reason
+
+
+def test_atom_counts(validator, restart_set):
+    assert validator.validate_set(restart_set, atoms=5)[0] is False
+
+    write_binary(restart_set['vel'], [(0.1, 0.0, 0.0)] * 5)
+    valid, reason = validator.validate_set(restart_set)
+    assert not valid
+    assert reason == 'coor and vel atom counts differ'
+
+
+def test_validate_sets(validator, tmp_path):
+    good = write_set(str(tmp_path), 'a', 100)
+    bad = write_set(str(tmp_path), 'b', 100, velocity=50.0)
+    results = validator.validate_sets([good, bad])
+    assert results[0] == (True, None)
+    assert results[1][0] is False
@@ -0,0 +1,60 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from conftest import write_set, write_xsc
+from restart_watcher import RestartSet
+import os
+
+
+def touch(path, mtime):
+    """Set mtime of a file"""
+
+    os.utime(path, (mtime, mtime))
+
+
+def test_ready_and_mark(tmp_path):
+    files = write_set(str(tmp_path), 'prod', 1000)
+    restart_set = RestartSet(str(tmp_path / 'prod'))
+    for path in files.values():
+        touch(path, 1000)
+
+    assert restart_set.ready() == 1000
+    restart_set.mark(1000)
+    assert restart_set.ready() is None
+
+    write_xsc(files['xsc'], 2000)
+    for path in files.values():
+        touch(path, 1100)
+    assert restart_set.ready() == 2000
+
+
+def test_mixed_generation_not_ready(tmp_path):
+    old = write_set(str(tmp_path), 'prod', 1000, tag='old')
+    files = write_set(str(tmp_path), 'prod', 2000)
+    for path in old.values():
+        touch(path, 1000)
+    for path in files.values():
+        touch(path, 1120)
+    restart_set = RestartSet(str(tmp_path / 'prod'))
+    assert restart_set.ready() == 2000
+
+    # Restarts every 120 s, a coor written by the next write does not match vel and xsc
+    touch(files['coor'], 1240)
+    assert restart_set.ready() is None
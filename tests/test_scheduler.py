@@ -0,0 +1,96 @@
+"""
+    Namd Restarter - Automatically restart namd dynamics
+    Copyright (C) 2020  Arthur Pereira da Fonseca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Mail: arthurpfonseca3k@gmail.com
+"""
+
+from arguments_parser import make_parser
+from scheduler import unsupervised_options, get_backend, make_job, read_state, job_states
+import os
+
+
+def test_unsupervised_options():
+    parser = make_parser()
+    assert unsupervised_options(parser.parse_args(['-i', 'run', '-o', 'out', '--scheduler', 'slurm'])) == []
+    args = parser.parse_args(['-i', 'run', '-o', 'out', '--scheduler', 'slurm', '-B', '-M', '-W', '-R', '1'])
+    assert unsupervised_options(args) == ['-B/--backup', '-M/--metrics', '-W/--watchdog', '-R/--retries']
+
+
+def jobs(tmp_path, count=2):
+    """Jobs for prepared restarts"""
+
+    result = list()
+    for index in range(count):
+        folder = tmp_path / ('sys' + str(index))
+        folder.mkdir()
+        (folder / 'prod.conf').write_text('run 10\n')
+        result.append(make_job('namd', str(folder / 'prod'), 4))
+    return result
+
+
+def test_slurm_submit_and_status(tmp_path, stub, monkeypatch):
+    stub('sbatch', 'print(open(sys.argv[1]).read(), file=open(sys.argv[1] + ".seen", "w"))\nprint("4242;cluster")\n')
+    stub('squeue', 'print("4242_0 RUNNING")\nprint("4242_1 PENDING")\n')
+    monkeypatch.setenv('PATH', str(tmp_path / 'bin') + os.pathsep + os.environ['PATH'])
+
+    submitted = jobs(tmp_path, 3)
+    backend = get_backend('slurm', str(tmp_path / 'state'), walltime='01:00:00', array_limit=2)
+    ids = backend.submit(submitted)
+    assert ids == {job['conf']: '4242_' + str(index) for index, job in enumerate(submitted)}
+
+    script = read_state(str(tmp_path / 'state'))['submissions'][0]['script']
+    text = open(script).read()
+    assert '#SBATCH --array=0-2%2' in text
+    assert '#SBATCH --time=01:00:00' in text
+    assert '2) cd ' + str(tmp_path / 'sys2') in text
+
+    states = job_states(str(tmp_path / 'state'))
+    assert [states[job['conf']] for job in submitted] == [('4242_0', 'RUNNING'), ('4242_1', 'PENDING'),
+                                                         ('4242_2', 'FINISHED')]
+
+
+def test_pbs_status(tmp_path, stub, monkeypatch):
+    stub('qsub', 'print("77[].server")\n')
+    stub('qstat', 'print("Job id  Name  User  Time S Queue")\nprint("77[0].server  namd  me  0  R  q")\n')
+    monkeypatch.setenv('PATH', str(tmp_path / 'bin') + os.pathsep + os.environ['PATH'])
+
+    submitted = jobs(tmp_path)
+    ids = get_backend('pbs', str(tmp_path / 'state')).submit(submitted)
+    assert sorted(ids.values()) == ['77[0].server', '77[1].server']
+
+    states = job_states(str(tmp_path / 'state'))
+    assert states[submitted[0]['conf']] == ('77[0].server', 'RUNNING')
+    assert states[submitted[1]['conf']] == ('77[1].server', 'FINISHED')
+
+
+def test_missing_submit_command(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    assert get_backend('slurm', str(tmp_path / 'state')).submit(jobs(tmp_path)) == {}
+
+
+def test_local_backend(tmp_path, stub):
+    namd = stub('namd', 'print("Info: stub")\nif "fail" in open(sys.argv[-1]).read():\n'
+                        '    print("FATAL ERROR: atoms moving too fast", file=sys.stderr)\n')
+    submitted = jobs(tmp_path)
+    (tmp_path / 'sys1' / 'prod.conf').write_text('fail\n')
+    for job in submitted:
+        job['command'] = [namd, job['conf']]
+
+    ids = get_backend('local', str(tmp_path / 'state')).submit(submitted)
+    states = job_states(str(tmp_path / 'state'))
+    assert [states[job['conf']][1] for job in submitted] == ['COMPLETED', 'FAILED']
+    assert states[submitted[0]['conf']][0] == ids[submitted[0]['conf']]